@@ -0,0 +1,201 @@
+"""
+Benchmarks Normalise on the bundled font directories: python benchmark.py [--output results.json] [--compare baseline.json]
+[0] measures startup time, per-stage throughput, and end-to-end latency (p50/p99) for cold (nothing learned yet)
+    and warm (everything already learned) runs over generated corpora for several scripts
+[1] corpora are generated from a fixed seed, so runs on different versions are comparable
+[2] results are written as JSON, --compare prints every metric that got more than --threshold worse than a previous run
+    (p99 latencies only with --p99-threshold, they are too noisy to share the threshold)
+[3] both engines are the same class (normalise_monospace is normalise_all with the old argument order), 'all' runs
+    it on all_fonts and 'monospace' on monospace_fonts, where no character has to be measured at startup
+[4] the whole benchmark is run --runs times and the best result of each metric is kept, and warm latencies are
+    the time of --repeat calls per text (after an untimed pass) divided by --repeat, so timer noise on calls
+    of a few microseconds doesn't look like a regression
+"""
+import argparse, contextlib, io, json, platform, random, sys, time
+
+ENGINES = {'all': ('normalise_all', 'all_fonts'),
+           'monospace': ('normalise_monospace', 'monospace_fonts')}
+
+#(ranges of ords to pick from, share of ascii letters mixed in)
+SCRIPTS = {'ascii': ([(0x61, 0x7A), (0x41, 0x5A), (0x30, 0x39)], 1.0),
+           'latin_diacritics': ([(0xC0, 0xFF), (0x100, 0x17F), (0x1E00, 0x1EFF)], 0.6),
+           'arabic': ([(0x621, 0x64A), (0x660, 0x669)], 0.1),
+           'devanagari': ([(0x905, 0x939), (0x93E, 0x94D), (0x966, 0x96F)], 0.1),
+           'symbols': ([(0x2460, 0x24FF), (0x2500, 0x257F), (0x3001, 0x303F), (0xFF01, 0xFF5E)], 0.3),
+           'emoji': ([(0x1F600, 0x1F64F), (0x1F300, 0x1F3FF), (0x2600, 0x26FF)], 0.5)}
+
+STAGES = ['remove_illegal_chars', 'normalise_whitespace', 'remove_combining_chars', 'remove_control_chars',
+          'normalise_LINE_emojis', 'normalise_emojis', 'normalise_known', 'normalise_chars']
+
+def make_text(rng, ranges, ascii_share, length):
+    chars = []
+    while len(chars) < length:
+        if rng.random() < 0.15:
+            chars.append(" ")
+        elif rng.random() < ascii_share:
+            chars.append(chr(rng.randint(0x61, 0x7A)))
+        else:
+            lo, hi = rng.choice(ranges)
+            chars.append(chr(rng.randint(lo, hi)))
+    return "".join(chars)
+
+def make_line_emoji_text(rng, length):
+    #LINE emojis are a supplementary private use character, an id, some text, then U+10FFFF
+    parts = []
+    while sum([len(p) for p in parts]) < length:
+        if rng.random() < 0.3:
+            word = rng.choice(["smile", "ok", "seven", "oz.", "hello"])
+            parts.append(chr(0x100801) + chr(rng.randint(0x100101, 0x100170)) + word + chr(0x10FFFF))
+        else:
+            parts.append(make_text(rng, SCRIPTS['ascii'][0], 1.0, rng.randint(3, 8)) + " ")
+    return "".join(parts)
+
+def make_corpora(seed, n_texts, length):
+    rng = random.Random(seed)
+    corpora = {}
+    for name, (ranges, ascii_share) in sorted(SCRIPTS.items()):
+        corpora[name] = [make_text(rng, ranges, ascii_share, length) for i in range(n_texts)]
+    corpora['line_emoji'] = [make_line_emoji_text(rng, length) for i in range(n_texts)]
+    return corpora
+
+def percentiles(values):
+    values = sorted(values)
+    def p(q):
+        return values[min(int(q / 100.0 * len(values)), len(values) - 1)]
+    return {'p50_ms': p(50) * 1000, 'p99_ms': p(99) * 1000, 'mean_ms': sum(values) / len(values) * 1000}
+
+def reset_learned(n, known_normalisations, known_removal):
+    #forget everything learned by imaging so the next run is cold again
+    n.known_normalisations, n.known_removal = dict(known_normalisations), set(known_removal)
+    n.build_tables()
+
+def bench_engine(name, px_width, comparison, corpora, repeat):
+    module_name, font_dir = ENGINES[name]
+    module = __import__(module_name)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        n = module.Normalise(font_dir=font_dir, px_width=px_width, comparison=comparison)
+    results = {'startup_s': time.perf_counter() - start, 'corpora': {}}
+    known_normalisations, known_removal = dict(n.known_normalisations), set(n.known_removal)
+    for corpus_name, texts in sorted(corpora.items()):
+        chars = sum([len(t) for t in texts])
+        corpus_results = {'texts': len(texts), 'chars': chars, 'stages_chars_per_s': {}}
+        reset_learned(n, known_normalisations, known_removal)
+        #cold: every unknown character has to be drawn and compared the first time it is seen
+        cold = []
+        for text in texts:
+            t = time.perf_counter()
+            n.normalise(text)
+            cold.append(time.perf_counter() - t)
+        corpus_results['cold'] = percentiles(cold)
+        corpus_results['learned'] = len(n.known_normalisations) + len(n.known_removal) - len(known_normalisations) - len(known_removal)
+        #warm: everything has been learned already, and one pass has filled the translation tables
+        for text in texts:
+            n.normalise(text)
+        warm = []
+        for text in texts:
+            t = time.perf_counter()
+            for r in range(repeat):
+                n.normalise(text)
+            warm.append((time.perf_counter() - t) / repeat)
+        corpus_results['warm'] = percentiles(warm)
+        corpus_results['warm_chars_per_s'] = chars / max(sum(warm), 1e-9)
+        for stage in STAGES:
+            func = getattr(n, stage)
+            t = time.perf_counter()
+            for r in range(repeat):
+                for text in texts:
+                    func(text)
+            corpus_results['stages_chars_per_s'][stage] = chars * repeat / max(time.perf_counter() - t, 1e-9)
+        #imaging on its own: drawing and comparing every distinct unknown character in the corpus
+        reset_learned(n, known_normalisations, known_removal)
+        unknown = set().union(*[n.normalise_stages(t) for t in texts]) - n.allowed_chars
+        t = time.perf_counter()
+        if len(unknown) != 0:
+            n.learn_chars([ord(c) for c in unknown])
+        elapsed = time.perf_counter() - t
+        corpus_results['imaging'] = {'glyphs': len(unknown), 'glyphs_per_s': len(unknown) / max(elapsed, 1e-9)}
+        results['corpora'][corpus_name] = corpus_results
+    return results
+
+def best_of(runs, key=""):
+    """
+    Combines the results of several runs of bench_engine, keeping the highest rate (_per_s) and the lowest
+    of every other number (times), anything else is taken from the first run
+    """
+    first = runs[0]
+    if isinstance(first, dict):
+        return {k:best_of([run[k] for run in runs], k) for k in first}
+    if not isinstance(first, (int, float)) or isinstance(first, bool):
+        return first
+    return max(runs) if key.endswith("_per_s") else min(runs)
+
+def flatten(results, prefix=""):
+    flat = {}
+    for k, v in results.items():
+        if isinstance(v, dict):
+            flat.update(flatten(v, prefix + k + "."))
+        elif isinstance(v, (int, float)) and not isinstance(v, bool):
+            flat[prefix + k] = v
+    return flat
+
+def compare(results, baseline, threshold, p99_threshold=None):
+    """
+    Returns a line for every metric more than threshold (a fraction) worse than in baseline
+    [0] times (_s, _ms) are worse when higher, rates (_per_s) when lower, anything else is ignored
+    [1] p99 latencies are compared with p99_threshold instead, and not at all if it is None
+    """
+    new, old = flatten(results['engines']), flatten(baseline['engines'])
+    regressions = []
+    for key in sorted(set(new) & set(old)):
+        limit = p99_threshold if key.endswith("p99_ms") else threshold
+        if old[key] == 0 or limit is None:
+            continue
+        change = (new[key] - old[key]) / float(old[key])
+        if key.endswith("_per_s"):
+            change = -change
+        elif not (key.endswith("_s") or key.endswith("_ms")):
+            continue
+        if change > limit:
+            regressions.append("%s: %.4g -> %.4g (%.0f%% worse)" % (key, old[key], new[key], change * 100))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python benchmark.py", description="Benchmark Normalise on the bundled font directories.")
+    parser.add_argument("--engine", action="append", choices=sorted(ENGINES), help="engine to benchmark (repeatable, default: both)")
+    parser.add_argument("--px-width", type=int, default=40)
+    parser.add_argument("--comparison", default="MSE", choices=["MSE", "NRMSE", "PSNR", "SSIM", "HAMMING"])
+    parser.add_argument("--texts", type=int, default=200, help="texts per corpus (default: 200)")
+    parser.add_argument("--length", type=int, default=80, help="characters per text (default: 80)")
+    parser.add_argument("--repeat", type=int, default=3, help="timed warm calls per text (default: 3)")
+    parser.add_argument("--runs", type=int, default=5, help="times to run the benchmark, the best of each metric is kept (default: 5)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-o", "--output", help="file to write the JSON results to (default: stdout)")
+    parser.add_argument("--compare", help="previous results to check for regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="regression threshold as a fraction (default: 0.2)")
+    parser.add_argument("--p99-threshold", type=float, help="regression threshold for p99 latencies (default: not compared)")
+    args = parser.parse_args(argv)
+
+    corpora = make_corpora(args.seed, args.texts, args.length)
+    results = {'settings': {'px_width': args.px_width, 'comparison': args.comparison, 'texts': args.texts,
+                            'length': args.length, 'repeat': args.repeat, 'runs': args.runs, 'seed': args.seed},
+               'python': sys.version.split()[0], 'platform': platform.platform(), 'engines': {}}
+    for name in (args.engine or sorted(ENGINES)):
+        runs = [bench_engine(name, args.px_width, args.comparison, corpora, args.repeat) for r in range(args.runs)]
+        results['engines'][name] = best_of(runs)
+    data = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(data + "\n")
+    else:
+        print(data)
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold, args.p99_threshold)
+        for r in regressions:
+            sys.stderr.write("Regression: %s\n" % r)
+        if len(regressions) != 0:
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
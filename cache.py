@@ -0,0 +1,73 @@
+"""
+On-disk cache for things that are slow to compute at startup (font metrics, template arrays)
+[0] files are named by a hash of everything they were computed from, so changing a font file,
+    px_width or library version just means a different file gets used (stale files are never read)
+[1] files are written to a temporary file first and then renamed, so other processes never see half a file
+"""
+import numpy as np
+import hashlib, os, tempfile
+
+#bump this whenever the format of anything that gets cached changes
+CACHE_VERSION = 2
+
+def library_versions():
+    import PIL, fontTools
+    return (CACHE_VERSION, np.__version__, PIL.__version__, fontTools.version)
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def make_key(*parts):
+    return hashlib.sha256(repr(parts + library_versions()).encode("utf-8")).hexdigest()[:32]
+
+def cache_path(cache_dir, name, key, ext):
+    return os.path.join(cache_dir, "%s-%s%s" % (name, key, ext))
+
+def write_atomic(path, write_func):
+    """
+    Calls write_func(file) on a temporary file in the same directory, then moves it to path
+    """
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write_func(f)
+        os.replace(tmp_path, path)
+    except:
+        os.remove(tmp_path)
+        raise
+
+def load_npz(path):
+    """
+    Returns the arrays saved at path as a dict, or None if there isn't a (readable) file there
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as data:
+            return {k: data[k] for k in data.files}
+    except (IOError, ValueError, KeyError):
+        return None
+
+def save_npz(path, **arrays):
+    write_atomic(path, lambda f: np.savez(f, **arrays))
+
+def load_npy(path, mmap_mode='r'):
+    """
+    Returns the array saved at path (memory-mapped by default, so processes share its pages), or None
+    """
+    if not os.path.exists(path):
+        return None
+    try:
+        return np.load(path, mmap_mode=mmap_mode)
+    except (IOError, ValueError):
+        return None
+
+def save_npy(path, array):
+    write_atomic(path, lambda f: np.save(f, array))
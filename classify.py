@@ -0,0 +1,37 @@
+"""
+Finds the ascii texts of a batch that can take Normalise.fast_path all at once
+[0] only ascii can be stable (in Normalise.stable_chars), so non-ascii texts never get here and the ascii ones
+    are encoded to one uint8 array, where every character is a single lookup in a 128 entry bool table
+[1] this only beats checking each text with frozenset.issuperset once texts average about 16 characters
+    (4096 texts: about the same at 10 characters, 0.79x at 20, 0.58x at 100), see Normalise.unstable_texts
+"""
+import numpy as np
+
+def build_stable_table(stable_chars):
+    """
+    Returns a bool array over 0..0x7F, True for the ords of stable_chars
+    """
+    table = np.zeros(0x80, dtype=bool)
+    table[[ord(c) for c in stable_chars]] = True
+    return table
+
+def ascii_codes(texts):
+    """
+    Returns the characters of every (ascii) text in one uint8 array, and where each text starts and how long it is
+    """
+    data = "".join(texts).encode("ascii")
+    lengths = np.array([len(t) for t in texts], dtype=np.intp)
+    starts = np.cumsum(lengths) - lengths
+    return np.frombuffer(data, dtype=np.uint8), starts, lengths
+
+def unstable_texts(stable_table, texts):
+    """
+    Returns a bool array, True for each ascii text with a character that isn't stable (False for empty texts)
+    """
+    codes, starts, lengths = ascii_codes(texts)
+    if len(codes) == 0:
+        return np.zeros(len(texts), dtype=bool)
+    #reduceat gives the value at the start index for empty texts, so those get reset
+    result = np.logical_or.reduceat(~stable_table[codes], np.minimum(starts, len(codes)-1))
+    result[lengths == 0] = False
+    return result
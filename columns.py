@@ -0,0 +1,64 @@
+"""
+Normalises whole pandas Series and pyarrow string arrays
+[0] every distinct value is normalised once (in one normalise_many call) and the results are mapped back,
+    so columns with a lot of repeated values cost about as much as their distinct values
+[1] engine is anything with normalise_many, ie a Normalise or a parallel.NormalisePool
+[2] missing values stay missing, and the index, name and string type of the column are kept
+[3] pandas and pyarrow are only imported when a column of theirs is passed
+"""
+
+def normalise_series(engine, series):
+    """
+    [0] a category series keeps its codes, only its categories get normalised (categories that normalise
+        to the same string are merged)
+    """
+    import pandas as pd
+    import numpy as np
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        #codes into the normalised categories, which don't have to be distinct any more
+        category_codes, categories = pd.factorize(np.array(engine.normalise_many(series.cat.categories), dtype=object))
+        #missing values have code -1, which takes the -1 added at the end
+        codes = np.append(category_codes, -1).take(series.cat.codes.to_numpy())
+        normalised = pd.Categorical.from_codes(codes, categories=categories, ordered=series.cat.ordered)
+        return pd.Series(normalised, index=series.index, name=series.name)
+    #missing values get code -1, which takes the None added at the end
+    codes, uniques = pd.factorize(series)
+    results = np.array(engine.normalise_many(uniques) + [None], dtype=object)
+    normalised = pd.Series(results.take(codes), index=series.index, name=series.name)
+    if series.dtype != object:
+        normalised = normalised.astype(series.dtype)
+    return normalised
+
+def normalise_arrow(engine, array):
+    """
+    [0] array can be a pyarrow Array or ChunkedArray of strings, or of dictionary encoded strings
+    [1] a dictionary encoded array keeps its indices, only its dictionary gets normalised
+        (the chunks of a ChunkedArray are given one dictionary first, so it is only normalised once)
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    if isinstance(array, pa.DictionaryArray):
+        return pa.DictionaryArray.from_arrays(array.indices, normalise_arrow(engine, array.dictionary))
+    if pa.types.is_dictionary(array.type):
+        array = array.unify_dictionaries()
+        if array.num_chunks == 0:
+            return array
+        dictionary = normalise_arrow(engine, array.chunk(0).dictionary)
+        return pa.chunked_array([pa.DictionaryArray.from_arrays(c.indices, dictionary) for c in array.chunks])
+    uniques = pc.unique(array)
+    values = uniques.to_pylist()
+    results = iter(engine.normalise_many([v for v in values if v is not None]))
+    normalised = pa.array([None if v is None else next(results) for v in values], type=array.type)
+    #nulls are looked up like any other value, so they map to the null in uniques
+    return pc.take(normalised, pc.index_in(array, value_set=uniques))
+
+def normalise_column(engine, column):
+    """
+    Normalises a pandas Series, a pyarrow array, or any other iterable of strings (returned as a list)
+    """
+    module = type(column).__module__
+    if module.startswith("pyarrow"):
+        return normalise_arrow(engine, column)
+    if module.startswith("pandas"):
+        return normalise_series(engine, column)
+    return engine.normalise_many(column)
@@ -0,0 +1,243 @@
+"""
+Vectorised versions of the skimage compare_* methods
+Every function compares a stack of unknown glyph arrays (n, H, W) against a stack of
+template arrays (m, H, W) and returns an (n, m) matrix of distances (lower is better)
+[0] PSNR and SSIM are similarities, so they are returned negated
+[1] arrays are expected to be uint8 "L" mode images, so the data range is 255
+[2] TemplateIndex finds the closest template for each array, optionally pruning the templates with a cheap coarse comparison first
+[3] HAMMING doesn't compare the arrays themselves but binarized, cropped, bit-packed copies (see PackedTemplateIndex)
+"""
+import numpy as np
+
+DATA_RANGE = 255.0
+#side of the blocks arrays are averaged over for TemplateIndex's coarse comparison
+COARSE_BLOCK = 4
+#pixels darker than this are ink when binarizing
+INK_THRESHOLD = 128
+#set bits in every byte, for numpy versions without bitwise_count
+POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def fit_width(array, width, fill=255):
+    """
+    Pads (with white) or crops an array on the right so that it is width pixels wide
+    """
+    h, w = array.shape
+    if w == width:
+        return array
+    if w > width:
+        return array[:, :width]
+    padded = np.full((h, width), fill, dtype=array.dtype)
+    padded[:, :w] = array
+    return padded
+
+def stack_arrays(arrays, width):
+    return np.ascontiguousarray(np.stack([fit_width(a, width) for a in arrays]))
+
+def _flatten(arrays):
+    return arrays.reshape(len(arrays), -1).astype(np.float64)
+
+def mse_templates(templates):
+    """
+    Returns the flattened float64 templates and their squared norms, for mse_matrix's prepared argument
+    """
+    t = _flatten(templates)
+    return t, (t*t).sum(axis=1)
+
+def mse_matrix(arrays, templates, prepared=None):
+    a = _flatten(arrays)
+    t, tt = prepared if prepared is not None else mse_templates(templates)
+    #(a-t)^2 = a^2 + t^2 - 2at, so the whole matrix is one matrix multiplication
+    d = (a*a).sum(axis=1)[:,None] + tt[None,:] - 2*a.dot(t.T)
+    return np.maximum(d, 0) / a.shape[1]
+
+def nrmse_matrix(arrays, templates, prepared=None):
+    #skimage's default 'Euclidean' normalisation, arrays are the im_true argument
+    a = _flatten(arrays)
+    denom = np.sqrt((a*a).mean(axis=1))[:,None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.sqrt(mse_matrix(arrays, templates, prepared)) / denom
+
+def psnr_matrix(arrays, templates, prepared=None):
+    with np.errstate(divide='ignore'):
+        return -10 * np.log10((DATA_RANGE ** 2) / mse_matrix(arrays, templates, prepared))
+
+def _box_mean(x, size):
+    #mean of every size x size window that fits entirely inside the last two axes
+    c = np.cumsum(np.cumsum(x, axis=-2), axis=-1)
+    c = np.pad(c, [(0,0)] * (x.ndim-2) + [(1,0), (1,0)], mode='constant')
+    s = c[..., size:, size:] - c[..., :-size, size:] - c[..., size:, :-size] + c[..., :-size, :-size]
+    return s / (size * size)
+
+def _ssim_window(shape, win_size):
+    win_size = min(win_size, *shape)
+    if win_size % 2 == 0:
+        win_size -= 1
+    return win_size, win_size ** 2 / (win_size ** 2 - 1.0)
+
+def ssim_templates(templates, win_size=7):
+    """
+    Returns the float64 templates and their local means and variances, for ssim_matrix's prepared argument
+    """
+    win_size, cov_norm = _ssim_window(templates.shape[1:], win_size)
+    t = templates.astype(np.float64)
+    ut = _box_mean(t, win_size)
+    return t, ut, cov_norm * (_box_mean(t*t, win_size) - ut*ut)
+
+def ssim_matrix(arrays, templates, win_size=7, K1=0.01, K2=0.03, prepared=None):
+    """
+    Same as skimage's compare_ssim with its default arguments
+    [0] skimage crops the (win_size-1)//2 border before averaging, so only windows
+        that fit entirely inside the image are needed and no edge padding is done
+    [1] templates are handled all at once, unknown arrays one at a time to bound memory
+    """
+    t, ut, vt = prepared if prepared is not None else ssim_templates(templates, win_size)
+    win_size, cov_norm = _ssim_window(templates.shape[1:], win_size)
+    C1, C2 = (K1 * DATA_RANGE) ** 2, (K2 * DATA_RANGE) ** 2
+    results = np.empty((len(arrays), len(templates)))
+    for i, array in enumerate(arrays):
+        x = array.astype(np.float64)
+        ux = _box_mean(x, win_size)
+        vx = cov_norm * (_box_mean(x*x, win_size) - ux*ux)
+        vxt = cov_norm * (_box_mean(x*t, win_size) - ux*ut)
+        S = ((2*ux*ut + C1) * (2*vxt + C2)) / ((ux*ux + ut*ut + C1) * (vx + vt + C2))
+        results[i] = -S.reshape(len(templates), -1).mean(axis=1)
+    return results
+
+def ink_box(ink):
+    """
+    Returns the (rows, columns) slices of the smallest box containing every ink pixel of the (n, H, W) bool stack
+    """
+    rows, cols = np.flatnonzero(ink.any(axis=(0, 2))), np.flatnonzero(ink.any(axis=(0, 1)))
+    if len(rows) == 0:
+        return slice(None), slice(None)
+    return slice(rows[0], rows[-1]+1), slice(cols[0], cols[-1]+1)
+
+def pack_bits(ink):
+    """
+    Packs every array of the (n, H, W) bool stack into a row of uint64 words
+    """
+    packed = np.packbits(ink.reshape(len(ink), -1), axis=1)
+    padding = -packed.shape[1] % 8
+    if padding:
+        packed = np.pad(packed, [(0, 0), (0, padding)], mode='constant')
+    return np.ascontiguousarray(packed).view(np.uint64)
+
+def popcount(words):
+    if hasattr(np, 'bitwise_count'):
+        return np.bitwise_count(words)
+    return POPCOUNT_TABLE[words.view(np.uint8)].reshape(words.shape + (8,)).sum(axis=-1)
+
+def hamming_matrix(arrays, templates):
+    """
+    Returns the number of bits that differ between every pair of packed rows (see pack_bits)
+    """
+    results = np.empty((len(arrays), len(templates)), dtype=np.int64)
+    for i, a in enumerate(arrays):
+        results[i] = popcount(np.bitwise_xor(templates, a)).sum(axis=1)
+    return results
+
+distance_matrices = {'MSE': mse_matrix,
+                     'NRMSE': nrmse_matrix,
+                     'PSNR': psnr_matrix,
+                     'SSIM': ssim_matrix}
+
+#what each distance matrix needs of the templates, so TemplateIndex can work it out once
+template_preparations = {'MSE': mse_templates,
+                         'NRMSE': mse_templates,
+                         'PSNR': mse_templates,
+                         'SSIM': ssim_templates}
+
+COMPARISONS = sorted(distance_matrices) + ['HAMMING']
+
+def downsample(arrays, block=COARSE_BLOCK):
+    """
+    Averages every block x block square of each array in the stack (rows and columns that don't fill a block are dropped)
+    """
+    n, h, w = arrays.shape
+    block = max(min(block, h, w), 1)
+    h, w = h - h % block, w - w % block
+    blocks = arrays[:, :h, :w].reshape(n, h // block, block, w // block, block)
+    return blocks.mean(axis=(2, 4))
+
+class TemplateIndex:
+
+    def __init__(self, templates, distance_matrix, candidates=None, block=COARSE_BLOCK, prepare_templates=None, prepared=None):
+        """
+        [0] if candidates is None every template is compared with distance_matrix (exact)
+        [1] otherwise the templates are ranked by the MSE of their downsampled arrays (one small matrix
+            multiplication) and only the best candidates get the full comparison
+        [2] ties go to the template that comes first, like argmin over every template
+        [3] prepare_templates(templates) is worked out once here and passed to distance_matrix as prepared
+            (eg the float64 templates and their norms), instead of being redone on every call
+        [4] prepared can be passed in instead (eg memory-mapped from the cache, so processes share it)
+        """
+        assert (candidates is None or (type(candidates) == int and candidates > 0)), "candidates must be None or a positive integer."
+        self.distance_matrix = distance_matrix
+        self.candidates = len(templates) if candidates is None else min(candidates, len(templates))
+        self.block = block
+        self.templates, self.features = self.prepare(templates, self.candidates < len(templates))
+        if prepared is None and prepare_templates is not None:
+            prepared = prepare_templates(self.templates)
+        self.prepared = prepared
+        self.prepared_features = mse_templates(self.features) if self.features is not None else None
+
+    def prepare(self, arrays, coarse):
+        """
+        Returns what distance_matrix compares for the (n, H, W) stack, and its coarse features if coarse is True
+        """
+        return arrays, downsample(arrays, self.block) if coarse else None
+
+    def distances(self, arrays, selection=None):
+        """
+        Returns the distance matrix between arrays (already prepared) and every template, or the templates in selection
+        """
+        templates, prepared = self.templates, self.prepared
+        if selection is not None:
+            templates = templates[selection]
+            if prepared is not None:
+                prepared = tuple([p[selection] for p in prepared])
+        if prepared is None:
+            return self.distance_matrix(arrays, templates)
+        return self.distance_matrix(arrays, templates, prepared=prepared)
+
+    def nearest(self, arrays):
+        """
+        Returns the index of the closest template for each array in the (n, H, W) stack
+        """
+        arrays, features = self.prepare(arrays, self.features is not None)
+        if self.features is None:
+            return self.distances(arrays).argmin(axis=1)
+        coarse = mse_matrix(features, self.features, self.prepared_features)
+        candidates = np.sort(np.argpartition(coarse, self.candidates-1, axis=1)[:, :self.candidates], axis=1)
+        best = np.empty(len(arrays), dtype=np.intp)
+        for i, c in enumerate(candidates):
+            best[i] = c[self.distances(arrays[i:i+1], c)[0].argmin()]
+        return best
+
+class PackedTemplateIndex(TemplateIndex):
+
+    def __init__(self, templates, candidates=None, block=COARSE_BLOCK, threshold=INK_THRESHOLD):
+        """
+        [0] arrays are binarized (pixels darker than threshold are ink), cropped to the box around all the
+            templates' ink, and packed 64 pixels to a word, so templates take 8x less memory (more after cropping)
+        [1] the distance is the number of pixels that differ, worked out with XOR and popcount
+        [2] coarse features (for candidates) are block averages of the cropped ink
+        """
+        self.threshold = threshold
+        self.box = ink_box(templates < threshold)
+        TemplateIndex.__init__(self, templates, hamming_matrix, candidates, block)
+
+    def prepare(self, arrays, coarse):
+        rows, cols = self.box
+        ink = arrays[:, rows, cols] < self.threshold
+        return pack_bits(ink), downsample(ink, self.block) if coarse else None
+
+def template_index(comparison, templates, candidates=None, prepared=None):
+    """
+    Returns the index that finds the closest of templates using comparison (one of COMPARISONS)
+    prepared is what template_preparations[comparison] returns for templates, if it was already worked out
+    """
+    if comparison == 'HAMMING':
+        return PackedTemplateIndex(templates, candidates)
+    return TemplateIndex(templates, distance_matrices[comparison], candidates,
+                         prepare_templates=template_preparations[comparison], prepared=prepared)
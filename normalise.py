@@ -0,0 +1,186 @@
+"""
+Command line entry point: python -m normalise FONT_DIR [FILE ...]
+Normalises every line of the files (or stdin) and writes them to stdout (or --output)
+[0] input is read in batches of --batch-size lines, so memory use doesn't depend on the file size
+[1] with --jsonl every line is a JSON object and only the --field keys get normalised
+[2] with --workers the lines are streamed through that many processes (see parallel.NormalisePool.imap),
+    so workers don't wait for each other at the end of every batch
+[3] a throughput and latency (per --batch-size lines written) report is written to stderr at the end
+[4] options can come before or after the files
+"""
+from parallel import chunks
+import argparse, collections, contextlib, io, json, sys, time
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(prog="python -m normalise", description="Normalise text line by line.")
+    parser.add_argument("font_dir", help="directory of .ttf fonts to use")
+    parser.add_argument("files", nargs="*", help="files to normalise (default: stdin)")
+    parser.add_argument("-o", "--output", help="file to write to (default: stdout)")
+    parser.add_argument("--monospace", action="store_true", help="use normalise_monospace (normalise_all with the old argument order)")
+    parser.add_argument("--px-width", type=int, default=40)
+    parser.add_argument("--comparison", default="MSE", choices=["MSE", "NRMSE", "PSNR", "SSIM", "HAMMING"])
+    parser.add_argument("--db", help="sqlite database of learned normalisations")
+    parser.add_argument("--cache-dir", help="directory to cache font metrics and template arrays in")
+    parser.add_argument("--candidates", type=int, help="only fully compare this many templates, picked by a coarse comparison")
+    parser.add_argument("--lazy-fonts", action="store_true", help="only read font cmaps at startup, measure fonts when first needed")
+    parser.add_argument("--table", help="normalisation table compiled by static_table.py")
+    parser.add_argument("--jsonl", action="store_true", help="input lines are JSON objects")
+    parser.add_argument("--field", action="append", default=[], help="JSON key to normalise (repeatable, needs --jsonl)")
+    parser.add_argument("--batch-size", type=int, default=1024, help="lines normalised together (default: 1024)")
+    parser.add_argument("--workers", type=int, default=1, help="number of processes (default: 1)")
+    #files is positional, so plain parse_args would stop taking them at the first option after FONT_DIR
+    args = parser.parse_intermixed_args(argv)
+    if args.jsonl and len(args.field) == 0:
+        parser.error("--jsonl needs at least one --field")
+    if args.field and not args.jsonl:
+        parser.error("--field needs --jsonl")
+    if args.batch_size < 1 or args.workers < 1:
+        parser.error("--batch-size and --workers must be positive")
+    return args
+
+def load_normaliser(args):
+    if args.monospace:
+        from normalise_monospace import Normalise
+    else:
+        from normalise_all import Normalise
+    #Normalise prints its loading progress, which mustn't end up in the output
+    with contextlib.redirect_stdout(sys.stderr):
+        return Normalise(font_dir=args.font_dir, px_width=args.px_width, comparison=args.comparison,
+                         db_path=args.db, cache_dir=args.cache_dir, lazy_fonts=args.lazy_fonts,
+                         table_path=args.table, candidates=args.candidates)
+
+def read_lines(files):
+    #invalid utf-8 becomes lone surrogates, which get removed as illegal characters
+    if len(files) == 0:
+        for line in io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", errors="surrogateescape"):
+            yield line.rstrip("\r\n")
+    for path in files:
+        with io.open(path, encoding="utf-8", errors="surrogateescape") as f:
+            for line in f:
+                yield line.rstrip("\r\n")
+
+def counted(lines, stats):
+    for line in lines:
+        stats['lines'] += 1
+        stats['chars'] += len(line)
+        yield line
+
+def parse_record(line, fields, stats):
+    """
+    Returns the JSON object in line (None if it isn't valid JSON) and the fields of it to normalise
+    """
+    try:
+        record = json.loads(line)
+    except ValueError:
+        stats['bad_lines'] += 1
+        return None, []
+    if not isinstance(record, dict):
+        return record, []
+    return record, [field for field in fields if isinstance(record.get(field), str)]
+
+def dump_record(line, record):
+    #lines that aren't JSON are passed through unchanged
+    return line if record is None else json.dumps(record)
+
+def normalise_jsonl(engine, lines, fields, stats):
+    records, texts, targets = [], [], []
+    for line in lines:
+        record, record_fields = parse_record(line, fields, stats)
+        records.append(record)
+        for field in record_fields:
+            texts.append(record[field])
+            targets.append((record, field))
+    for (record, field), text in zip(targets, engine.normalise_many(texts)):
+        record[field] = text
+    return [dump_record(line, record) for line, record in zip(lines, records)]
+
+def stream_jsonl(pool, lines, fields, stats):
+    """
+    Same as normalise_jsonl over every line, but with the texts streamed through pool.imap
+    [0] a line is yielded as soon as all its fields are back, in the order the lines were read
+    [1] a line with no fields to normalise sends an empty placeholder text, so every line waits on the pool
+        and at most the texts the pool has in flight are held here
+    """
+    #[line, record, texts still to come back] for every line not yet yielded, and (entry, field) for every text sent
+    pending, sent = collections.deque(), collections.deque()
+    def texts():
+        for line in lines:
+            record, record_fields = parse_record(line, fields, stats)
+            entry = [line, record, max(len(record_fields), 1)]
+            pending.append(entry)
+            if len(record_fields) == 0:
+                sent.append((entry, None))
+                yield ""
+            for field in record_fields:
+                sent.append((entry, field))
+                yield record[field]
+    for text in pool.imap(texts()):
+        entry, field = sent.popleft()
+        if field is not None:
+            entry[1][field] = text
+        entry[2] -= 1
+        while len(pending) != 0 and pending[0][2] == 0:
+            line, record, remaining = pending.popleft()
+            yield dump_record(line, record)
+
+def normalised_lines(engine, pool, lines, args, stats):
+    """
+    Yields the normalised lines in order, batch by batch without a pool, streamed through it with one
+    """
+    if pool is not None:
+        results = stream_jsonl(pool, lines, args.field, stats) if args.jsonl else pool.imap(lines)
+        for result in results:
+            yield result
+        return
+    for batch in chunks(lines, args.batch_size):
+        results = normalise_jsonl(engine, batch, args.field, stats) if args.jsonl else engine.normalise_many(batch)
+        for result in results:
+            yield result
+
+def percentile(sorted_values, p):
+    if len(sorted_values) == 0:
+        return 0.0
+    return sorted_values[min(int(p / 100.0 * len(sorted_values)), len(sorted_values) - 1)]
+
+def report(stats, latencies, elapsed):
+    latencies = sorted(latencies)
+    elapsed = max(elapsed, 1e-9)
+    lines = ["Normalised %s line(s) (%s characters) in %.2fs" % (stats['lines'], stats['chars'], elapsed),
+             "Throughput: %.1f lines/s, %.1f characters/s" % (stats['lines'] / elapsed, stats['chars'] / elapsed),
+             "Batch latency: p50 %.1fms, p99 %.1fms, max %.1fms (%s batches)" % (percentile(latencies, 50) * 1000,
+                 percentile(latencies, 99) * 1000, (latencies[-1] if latencies else 0) * 1000, len(latencies))]
+    if stats['bad_lines']:
+        lines.append("%s line(s) were not valid JSON and were passed through unchanged" % stats['bad_lines'])
+    sys.stderr.write("\n".join(lines) + "\n")
+
+def main(argv=None):
+    args = parse_args(argv)
+    normaliser = load_normaliser(args)
+    pool = None
+    if args.workers > 1:
+        from parallel import NormalisePool
+        chunk_size = max(args.batch_size // args.workers, 1)
+        pool = NormalisePool(normaliser, processes=args.workers, chunk_size=chunk_size)
+    #surrogateescape so lines passed through unchanged are written back as they were read
+    out = io.open(args.output, "w", encoding="utf-8", errors="surrogateescape") if args.output \
+        else io.TextIOWrapper(sys.stdout.buffer, encoding="utf-8", errors="surrogateescape")
+    stats = {'lines': 0, 'chars': 0, 'bad_lines': 0}
+    latencies = []
+    start = batch_start = time.time()
+    try:
+        lines = counted(read_lines(args.files), stats)
+        for results in chunks(normalised_lines(normaliser, pool, lines, args, stats), args.batch_size):
+            latencies.append(time.time() - batch_start)
+            out.write("".join([r + "\n" for r in results]))
+            batch_start = time.time()
+    finally:
+        out.flush()
+        if args.output:
+            out.close()
+        if pool is not None:
+            pool.close()
+        normaliser.close_db()
+    report(stats, latencies, time.time() - start)
+
+if __name__ == "__main__":
+    main()
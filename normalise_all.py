@@ -1,14 +1,40 @@
-from skimage.measure import compare_mse, compare_nrmse, compare_ssim, compare_psnr
-# MSE and NRMSE are tied for joint first, and the other two are tied for joint last in how well they work (imo)
-from PIL import Image, ImageFont, ImageDraw
-from fontTools.ttLib import TTFont
 from word2number import w2n
-import numpy as np
-import os, unicodedata, itertools, uuid
+try:
+    from PIL import Image, ImageFont, ImageDraw
+    from fontTools.ttLib import TTFont
+    import numpy as np
+    # MSE and NRMSE are tied for joint first, and the other two are tied for joint last in how well they work (imo)
+    import comparisons, cache, classify
+except ImportError:
+    #only needed to draw characters, a Normalise that only uses a compiled table (font_dir=None) works without them
+    np = None
+import static_table, columns
+from translation import TranslationTable, IntervalSet, chain_chars, count_changes
+from stats import NormaliseStats
+import os, unicodedata, itertools, uuid, sqlite3, atexit, threading, time, math, re, functools
+
+#normalise_many batches at least this big are classified with numpy (see classify.py)
+CLASSIFY_MIN_BATCH = 256
+#and only if those texts average at least this many characters, below that checking them one at a time is as fast
+CLASSIFY_MIN_LENGTH = 16
+
+#a LINE emoji is a supplementary private use character, then anything up to U+10FFFF
+#a lone character from that range (or a U+10FFFF without a start) gets removed
+LINE_EMOJI_REGEX = re.compile("[\U000F0001-\U0010FFFE][^\U0010FFFF]*\U0010FFFF|[\U000F0001-\U0010FFFF]")
+
+@functools.lru_cache(maxsize=4096)
+def word_to_num(words):
+    """
+    Returns the number words spells out as a string, or None
+    """
+    try:
+        return str(w2n.word_to_num(words))
+    except Exception:
+        return None
 
 class Normalise:
 
-    def __init__(self, font_dir=None, px_width=40, comparison='MSE', debug=False):
+    def __init__(self, font_dir=None, px_width=40, comparison='MSE', debug=False, db_path=None, db_batch_size=64, cache_dir=None, instrument=False, stats_callback=None, lazy_fonts=False, table_path=None, candidates=None):
         """
         ALL FONTS MUST BE UNICODE FONTS AND SUPPORT 0x20 (space) - THIS IS CHECKED
         [0] Only the space character (0x20) is checked to be the px_width when determining font size
@@ -17,85 +43,309 @@ class Normalise:
         [3] Don't include any emoji fonts as these won't be used (since emoji characters get removed)
         [4] Right now only TrueType fonts are supported
         [5] Coloured fonts such as NotoColorEmoji don't work and raise an error
+        [6] If db_path is given, learned normalisations are loaded from and saved to an sqlite database there
+        [7] If cache_dir is given, font metrics and template arrays are cached there so later startups don't have to redo them
+        [8] One instance can be shared between threads (see update_known)
+        [9] If instrument is True, per-stage timings and counts are collected in self.stats, and
+            stats_callback(stage, seconds, removed, replaced) is called after every stage if given
+        [10] Monospace fonts are detected when loading, and their characters aren't measured one by one (see monospace_widths)
+        [11] If lazy_fonts is True, only the cmap of each font is read at startup, everything else is done
+             the first time a character needs that font (self.height is then estimated from the font metrics)
+        [12] If table_path is given, the normalisations in a table compiled by static_table.py are loaded, so characters it
+             covers are never drawn. With font_dir=None only the table is used, and PIL, numpy and fontTools aren't needed
+        [13] If candidates is given, templates are first ranked by a cheap comparison of downsampled arrays and only that many
+             get the full comparison (see comparisons.TemplateIndex), which is much faster with thousands of allowed chars
+        [14] HAMMING compares binarized, bit-packed templates (see comparisons.PackedTemplateIndex), which is the fastest
+             and uses the least memory, but loses anti-aliasing detail
         """
-        assert (type(font_dir) == str), "font_dir must be a string."
+        assert (type(font_dir) == str or (font_dir is None and table_path is not None)), "font_dir must be a string (or None if table_path is given)."
+        assert (table_path is None or type(table_path) == str), "table_path must be None or a path string."
+        assert (candidates is None or (type(candidates) == int and candidates > 0)), "candidates must be None or a positive integer."
         assert (type(px_width) == int), "Width must be an integer."
         assert (px_width > 4), "Width cannot be less than 5px."
         assert (px_width <= 100), "Width cannot be greater than 100px."
         assert (type(debug) == bool), "Debug must be True or False."
-        assert (comparison in ['MSE','NRMSE','SSIM','PSNR']), "Comparison must be one of these 4 methods: MSE, NRMSE, SSIM, or PSNR."
+        assert (db_path is None or type(db_path) == str), "db_path must be None or a path string."
+        assert (type(db_batch_size) == int and db_batch_size > 0), "db_batch_size must be a positive integer."
+        assert (cache_dir is None or type(cache_dir) == str), "cache_dir must be None or a path string."
+        assert (type(instrument) == bool), "instrument must be True or False."
+        assert (type(lazy_fonts) == bool), "lazy_fonts must be True or False."
+        assert (stats_callback is None or callable(stats_callback)), "stats_callback must be None or callable."
+        assert (comparison in ['MSE','NRMSE','SSIM','PSNR','HAMMING']), "Comparison must be one of these 5 methods: MSE, NRMSE, SSIM, PSNR, or HAMMING."
 
         self.is_startup = True
+        #writers (update_known and the database) take the lock, readers never do
+        self.lock = threading.RLock()
+        self.local = threading.local()
+
+        if font_dir is not None and np is None:
+            raise Exception("PIL, numpy and fontTools are needed to draw characters, install them or only use a compiled table (font_dir=None).")
+        self.font_dir = font_dir
+        self.table = static_table.load_table(table_path) if table_path is not None else None
 
         #comparison methods
-        comparisons = {'MSE': compare_mse,
-                       'NRMSE': compare_nrmse,
-                       'PSNR': compare_psnr,
-                       'SSIM': compare_ssim}
-        self.comparison = comparisons[comparison]
+        self.comparison = comparison
+        self.candidates = candidates
+
+        #instrumentation
+        self.instrument = instrument
+        self.stats_callback = stats_callback
+        self.stats = NormaliseStats()
 
         #font loading
         self.debug = debug
+        self.cache_dir = cache_dir
         self.width, self.height = px_width, 0
-        allowed_font_types = (".ttf")
-        if font_dir.endswith("/"):
-            font_dir = font_dir[:-1]
-        fonts = os.listdir(font_dir)
-        self.font_names = [f for f in fonts if f.endswith(allowed_font_types)]
-        self.font_objects = {}
-        self.font_points = {}
-        for fn in self.font_names:
-            path = font_dir+"/"+fn
-            unicode_dict, size, font_obj = self.get_ttf_info(path, fn)
-            self.font_objects[fn] = font_obj
-            self.font_points[fn] = unicode_dict
-        print("Loaded %s font file(s)." % len(self.font_names))
-        total_font_points = set(itertools.chain.from_iterable([v.keys() for v in self.font_points.values()]))
-        print("Total %s unique unicode character points supported." % len(total_font_points))
+        self.lazy_fonts = lazy_fonts
+        if font_dir is not None:
+            self.load_fonts(font_dir)
+        else:
+            self.font_names, self.font_index, self.monospace_fonts = [], {}, set([])
 
         #db stuff
         self.known_normalisations = {} #IMPORTANT k:v --> ord:str NOT ord:ord (but it IS stored in db as ord:ord)
         self.known_removal = set([])
+        self.db_path, self.db_batch_size = db_path, db_batch_size
+        if font_dir is not None:
+            #the height changes how characters are drawn (and with lazy_fonts it is only an estimate)
+            self.db_profile = "%s:%s:%s:%s" % (comparison, px_width, self.height, ",".join(sorted(self.font_names)))
+            if candidates is not None:
+                #pruning can pick a different template, so these are learned separately
+                self.db_profile += ":%s" % candidates
+        else:
+            self.db_profile = self.table['profile']
         self.load_db()
         
         #character ranges and ints from json
         self.generate_char_info()
+        if self.table is not None:
+            self.load_table()
+        self.build_tables()
         self.is_startup = False
 
-    def get_ttf_info(self, font_path, font_name):
-        f = TTFont(font_path)
+    def load_fonts(self, font_dir):
+        """
+        Loads every .ttf font in font_dir (only their cmaps if self.lazy_fonts) and builds self.font_index
+        """
+        allowed_font_types = (".ttf")
+        if font_dir.endswith("/"):
+            font_dir = font_dir[:-1]
+        fonts = os.listdir(font_dir)
+        self.font_names = [f for f in fonts if f.endswith(allowed_font_types)]
+        self.font_objects = {}
+        self.font_paths = {}
+        self.font_sizes = {}
+        self.font_digests = {}
+        self.font_points = {}
+        #fonts whose characters are laid out in whole self.width cells
+        self.monospace_fonts = set([])
+        for fn in self.font_names:
+            self.font_paths[fn] = font_dir+"/"+fn
+            if self.lazy_fonts:
+                self.font_points[fn], height = self.get_ttf_cmap(self.font_paths[fn], fn)
+                self.height = max(self.height, height)
+            else:
+                self.load_font(fn)
+        print("Loaded %s font file(s) (%s monospace)." % (len(self.font_names), len(self.monospace_fonts)))
+        self.build_font_index()
+        print("Total %s unique unicode character points supported." % len(self.font_index))
+
+    def load_font(self, font_name):
+        """
+        Measures a font and creates its PIL font object
+        Done for every font at startup, or the first time a font is needed if lazy_fonts is True
+        """
+        if font_name in self.font_objects:
+            return
+        with self.lock:
+            if font_name in self.font_objects:
+                return
+            unicode_dict, size, font_obj, height, monospace = self.get_ttf_info(self.font_paths[font_name], font_name)
+            if not self.lazy_fonts:
+                self.height = max(self.height, height)
+            elif height > self.height:
+                print("Font %s has characters taller than the estimated height, they will be cut off." % font_name)
+            self.font_points[font_name] = unicode_dict
+            self.font_sizes[font_name] = size
+            if monospace:
+                self.monospace_fonts.add(font_name)
+            #this thread draws with the face it just created, other threads create their own in font_object
+            self.thread_font_objects()[font_name] = font_obj
+            #last, since this is what marks the font as loaded
+            self.font_objects[font_name] = font_obj
+
+    def font_digest(self, font_path):
+        if font_path not in self.font_digests:
+            self.font_digests[font_path] = cache.file_digest(font_path)
+        return self.font_digests[font_path]
+
+    def read_cmap(self, f, font_path):
         #check to make sure it's a unicode font
         cmap_tables = [cmap.cmap for cmap in f['cmap'].tables if cmap.isUnicode()]
         assert (len(cmap_tables) != 0), "%s is not a unicode font and cannot be used here." % font_path
-        combined_cmap = {k:v for ct in cmap_tables for k,v in ct.items()}
+        return {k:v for ct in cmap_tables for k,v in ct.items()}
+
+    def get_ttf_cmap(self, font_path, font_name):
+        """
+        Returns {ord: None} for a font file and an estimate of the height its characters need, without measuring any characters
+        [0] the height is the ascent plus the lowest descent in hhea/head, at the estimated font size
+        """
+        f = TTFont(font_path, lazy=True)
+        cmap = self.read_cmap(f, font_path)
+        if 32 not in cmap or f['hmtx'][cmap[32]][0] == 0:
+            raise Exception("Font does not support space (0x20) character (font path: %s)." % font_path)
+        print("Font %s contributed %s characters (not loaded yet)" % (font_name, len(cmap)))
+        return dict.fromkeys(cmap), self.estimate_height(f, cmap)
+
+    def estimate_height(self, f, cmap):
+        """
+        Returns the ascent plus the lowest descent in hhea/head, at the size where the space (0x20) is self.width wide
+        """
+        scale = self.width / float(f['hmtx'][cmap[32]][0])
+        descent = max(-f['hhea'].descent, -f['head'].yMin, 0)
+        return int(math.ceil((f['hhea'].ascent + descent) * scale)) + 1
+
+    def monospace_widths(self, f, cmap):
+        """
+        Returns {ord: width in pixels} without measuring any characters if the font is monospace, otherwise None
+        [0] monospace means post.isFixedPitch is set, or every glyph advances 0 or a whole number of spaces (0x20),
+            like the double width characters of CJK monospace fonts
+        [1] every character gets as many self.width cells as it advances spaces (at least one), and whatever
+            it draws outside them is cut off
+        """
+        hmtx = f['hmtx']
+        space = hmtx[cmap[32]][0]
+        advances = {o:hmtx[g][0] for o,g in cmap.items()}
+        if not f['post'].isFixedPitch and any([a % space != 0 for a in advances.values()]):
+            return None
+        return {o:max(a // space, 1) * self.width for o,a in advances.items()}
+
+    def get_ttf_info(self, font_path, font_name):
+        """
+        Returns {ord: width in pixels}, font size, the PIL font object, the tallest character's height,
+        and whether it is monospace for a font file
+        [0] if self.cache_dir is set, the widths, size, height and monospace are cached there keyed by
+            the font file's hash, px_width and library versions
+        [1] characters of monospace fonts aren't measured, see monospace_widths
+        """
+        if self.cache_dir is not None:
+            key = cache.make_key(self.font_digest(font_path), self.width)
+            path = cache.cache_path(self.cache_dir, "font", key, ".npz")
+            cached = cache.load_npz(path)
+            if cached is not None:
+                size, height, monospace = int(cached['size']), int(cached['height']), bool(cached['monospace'])
+                uni_dict = dict(zip(cached['ords'].tolist(), cached['widths'].tolist()))
+                print("Font %s contributed %s characters (cached)" % (font_name, len(uni_dict)))
+                return uni_dict, size, ImageFont.truetype(font_path, size), height, monospace
+        f = TTFont(font_path)
+        combined_cmap = self.read_cmap(f, font_path)
         uni_decimals = list(combined_cmap.keys())
         #could use (font.getBestCmap().keys()) instead?
-        #get font size
-        size = 0
-        i = 0
-        try:
-            while size == 0:
-                f = ImageFont.truetype(font_path, i)
-                w,h = f.getsize(" ")
-                if w == self.width:
-                    size = i
-                i += 1
-        except Exception as e:
-            raise Exception("Font does not support space (0x20) character (font: %s)." % font_name)
-        #get individual character widths in pixels
-        uni_dict = {}
-        f = ImageFont.truetype(font_path, size)
-        for ud in uni_decimals:
-            w,h = f.getsize(chr(ud))
-            if h > self.height:
-                self.height = h
-            uni_dict[ud] = w
-        print("Font %s contributed %s characters" % (font_name, len(uni_decimals)))
-        return uni_dict, size, f
+        size = self.get_font_size(f, combined_cmap, font_path)
+        uni_dict = self.monospace_widths(f, combined_cmap)
+        monospace = uni_dict is not None
+        if monospace:
+            height = self.estimate_height(f, combined_cmap)
+            f = ImageFont.truetype(font_path, size)
+        else:
+            #get individual character widths in pixels
+            uni_dict = {}
+            height = 0
+            f = ImageFont.truetype(font_path, size)
+            for ud in uni_decimals:
+                w,h = f.getsize(chr(ud))
+                if h > height:
+                    height = h
+                uni_dict[ud] = w
+        if self.cache_dir is not None:
+            cache.save_npz(path, ords=np.array(uni_decimals, dtype=np.uint32),
+                           widths=np.array([uni_dict[ud] for ud in uni_decimals], dtype=np.int32),
+                           size=np.array(size), height=np.array(height), monospace=np.array(monospace))
+        print("Font %s contributed %s characters%s" % (font_name, len(uni_decimals), " (monospace)" if monospace else ""))
+        return uni_dict, size, f, height, monospace
+
+    def get_font_size(self, f, cmap, font_path):
+        """
+        Returns the smallest font size at which the space character (0x20) is self.width pixels wide
+        [0] the size is estimated from the space advance width in hmtx and head.unitsPerEm
+        [1] the estimate is then checked against PIL's rendered width with a short bisection
+        """
+        if 32 not in cmap:
+            raise Exception("Font does not support space (0x20) character (font path: %s)." % font_path)
+        advance = f['hmtx'][cmap[32]][0]
+        if advance == 0:
+            raise Exception("Space (0x20) character has no width (font path: %s)." % font_path)
+        estimate = max(int(round(self.width * f['head'].unitsPerEm / float(advance))), 1)
+        widths = {0: 0}
+        def space_width(size):
+            if size not in widths:
+                widths[size] = ImageFont.truetype(font_path, size).getsize(" ")[0]
+            return widths[size]
+        #widen the bracket around the estimate until lo is too narrow and hi is wide enough
+        lo, hi = max(estimate-2, 0), estimate+2
+        while space_width(lo) >= self.width:
+            lo = max(lo-4, 0)
+        while space_width(hi) < self.width:
+            if hi > 4*estimate+100:
+                raise Exception("No font size makes the space (0x20) character %spx wide (font path: %s)." % (self.width, font_path))
+            hi += 4
+        while hi-lo > 1:
+            mid = (lo+hi) // 2
+            if space_width(mid) >= self.width:
+                hi = mid
+            else:
+                lo = mid
+        if space_width(hi) != self.width:
+            raise Exception("No font size makes the space (0x20) character %spx wide (font path: %s)." % (self.width, font_path))
+        return hi
 
     def load_db(self):
-        #do something later
-        pass
+        """
+        Loads previously learned normalisations from the database at self.db_path
+        [0] known_normalisations are stored as ord:ord, known_removal as ord
+        [1] rows are keyed by self.db_profile (comparison, px_width, height and fonts) since they were learned with those
+        [2] nothing is loaded or saved if db_path is None
+        """
+        self.db = None
+        self.db_pending_normalisations = {}
+        self.db_pending_removal = set([])
+        if self.db_path is None:
+            return
+        self.db = sqlite3.connect(self.db_path, check_same_thread=False)
+        with self.db:
+            self.db.execute("CREATE TABLE IF NOT EXISTS known_normalisations (profile TEXT NOT NULL, ord INTEGER NOT NULL, norm_ord INTEGER NOT NULL, PRIMARY KEY (profile, ord))")
+            self.db.execute("CREATE TABLE IF NOT EXISTS known_removal (profile TEXT NOT NULL, ord INTEGER NOT NULL, PRIMARY KEY (profile, ord))")
+        rows = self.db.execute("SELECT ord, norm_ord FROM known_normalisations WHERE profile = ?", (self.db_profile,))
+        self.known_normalisations.update({o:chr(no) for o,no in rows})
+        rows = self.db.execute("SELECT ord FROM known_removal WHERE profile = ?", (self.db_profile,))
+        self.known_removal |= set([o for (o,) in rows])
+        print("Loaded %s known normalisation(s) from database." % (len(self.known_normalisations) + len(self.known_removal)))
+        #pending writes would otherwise be lost when the process exits
+        atexit.register(self.flush_db)
+
+    def flush_db(self):
+        """
+        Writes all pending learned normalisations to the database in one transaction
+        """
+        with self.lock:
+            if self.db is None or (not self.db_pending_normalisations and not self.db_pending_removal):
+                return
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO known_normalisations (profile, ord, norm_ord) VALUES (?, ?, ?)",
+                                    [(self.db_profile, k, ord(v)) for k,v in self.db_pending_normalisations.items()])
+                self.db.executemany("INSERT OR REPLACE INTO known_removal (profile, ord) VALUES (?, ?)",
+                                    [(self.db_profile, k) for k in self.db_pending_removal])
+            self.db_pending_normalisations.clear()
+            self.db_pending_removal.clear()
+
+    def close_db(self):
+        with self.lock:
+            self.flush_db()
+            if self.db is not None:
+                self.db.close()
+                self.db = None
+                #nothing left to flush, and the registration would keep this instance alive until exit
+                atexit.unregister(self.flush_db)
 
     def generate_char_info(self):
         #ascii characters
@@ -112,9 +362,8 @@ class Normalise:
         #emoji characters - unicode v11.0
         emoji_ranges = [(8596, 8601), (8617, 8618), (8986, 8987), (9193, 9203), (9208, 9210), (9642, 9643), (9723, 9726), (9728, 9732), (9748, 9749), (9762, 9763), (9774, 9775), (9784, 9786), (9800, 9811), (9823, 9824), (9829, 9830), (9854, 9855), (9874, 9879), (9883, 9884), (9888, 9889), (9898, 9899), (9904, 9905), (9917, 9918), (9924, 9925), (9934, 9935), (9939, 9940), (9961, 9962), (9968, 9973), (9975, 9978), (9992, 9997), (10035, 10036), (10067, 10069), (10083, 10084), (10133, 10135), (10548, 10549), (11013, 11015), (11035, 11036), (127344, 127345), (127358, 127359), (127377, 127386), (127462, 127487), (127489, 127490), (127538, 127546), (127568, 127569), (127744, 127777), (127780, 127891), (127894, 127895), (127897, 127899), (127902, 127984), (127987, 127989), (127991, 127994), (127999, 128253), (128255, 128317), (128329, 128334), (128336, 128359), (128367, 128368), (128371, 128378), (128394, 128397), (128405, 128406), (128420, 128421), (128433, 128434), (128450, 128452), (128465, 128467), (128476, 128478), (128506, 128591), (128640, 128709), (128715, 128722), (128736, 128741), (128747, 128748), (128755, 128761), (129296, 129338), (129340, 129342), (129344, 129349), (129351, 129392), (129395, 129398), (129404, 129442), (129456, 129465), (129472, 129474), (129488, 129535), (917602, 917603), (917619, 917620)]
         emoji_ords = [169, 174, 8205, 8252, 8265, 8419, 8482, 8505, 9000, 9167, 9410, 9654, 9664, 9742, 9745, 9752, 9757, 9760, 9766, 9770, 9792, 9794, 9827, 9832, 9851, 9881, 9928, 9937, 9981, 9986, 9989, 9999, 10002, 10004, 10006, 10013, 10017, 10024, 10052, 10055, 10060, 10062, 10071, 10145, 10160, 10175, 11088, 11093, 12336, 12349, 12951, 12953, 65039, 126980, 127183, 127374, 127514, 127535, 128391, 128400, 128424, 128444, 128481, 128483, 128488, 128495, 128499, 128745, 128752, 129402, 917605, 917607, 917612, 917614, 917623, 917631]
-        for er in emoji_ranges:
-            emoji_ords += list(range(er[0], er[1]+1)) 
-        self.emoji_ords = set(emoji_ords)
+        self.emoji_ords = IntervalSet(emoji_ranges, emoji_ords)
+        self.emoji_regex = self.emoji_ords.regex()
         self.allowed_emojis = {10134: '-', 127374: 'ab', 127377: 'cl', 127378: 'cool', 127379: 'free', 127380: 'id', 127381: 'new', 10006: 'x', 127383: 'ok', 127384: 'sos', 127385: 'up', 127386: 'vs', 128283: 'on', 128281: 'back', 128285: 'top', 128176: '$', 8482: 'tm', 127382: 'ng', 169: 'c', 174: 'r', 128175: '100', 12336: '~', 127921: '8', 128178: '$', 129353: '3', 8505: 'i', 128282: 'end', 8252: '!!', 128702: 'wc', 9410: 'm', 127920: '777', 129351: '1', 129352: '2', 8265: '!?', 10060: 'x', 10062: 'x', 10067: '?', 10068: '?', 10069: '!', 11093: 'o', 10071: '!', 127975: 'atm', 127344: 'a', 127345: 'b', 128284: 'soon', 127359: 'p', 127358: 'o', 10133: '+'}
 
         #other extra - unicode v11.0
@@ -123,47 +372,146 @@ class Normalise:
         self.private_use_chars = set(range(57344, 63744))
 
         #make numpy arrrays of images of allowed_chars
-        self.char_arrays = {}
-        self.gen_arrays()
-        print("Generated template arrays.")
+        if self.font_dir is not None:
+            self.gen_arrays()
+            print("Generated template arrays.")
+
+    def load_table(self):
+        """
+        Adds the normalisations from the compiled table in self.table to the known normalisations
+        [0] the table has to have been compiled with the same fonts, px_width, height, comparison and allowed chars
+        [1] characters the table doesn't cover aren't supported by any of its fonts, so they are all drawn (and normalised) the same way
+        [2] without fonts db_profile comes from the table, so comparison, px_width and candidates are checked against it instead
+        """
+        if self.font_dir is None:
+            #comparison:px_width:height:fonts, then :candidates if they were set
+            comparison, px_width, height, rest = self.table['profile'].split(":", 3)
+            candidates = rest.rsplit(":", 1)[1] if ":" in rest else None
+            settings = (self.comparison, str(self.width), None if self.candidates is None else str(self.candidates))
+            if (comparison, px_width, candidates) != settings:
+                raise Exception("Table was compiled with comparison %s, px_width %s and candidates %s, not %s, %s and %s." %
+                                ((comparison, px_width, candidates) + settings))
+        if self.table['profile'] != self.db_profile:
+            raise Exception("Table was compiled for %s, not %s." % (self.table['profile'], self.db_profile))
+        if set(self.table['allowed_chars']) != self.allowed_chars:
+            raise Exception("Table was compiled with different allowed chars.")
+        self.known_normalisations.update(self.table['normalisations'])
+        self.known_removal |= self.table['removal']
+        print("Loaded %s normalisation(s) from compiled table." % (len(self.table['normalisations']) + len(self.table['removal'])))
 
     def gen_arrays(self):
+        """
+        Draws every allowed char and stacks them into one (n_templates, H, W) array so they get compared in one go
+        [0] if self.cache_dir is set, the stack is saved there as a .npy file keyed by the fonts, px_width
+            and allowed chars, and later loaded memory-mapped so every process shares the same pages
+        """
+        self.template_chars = sorted(self.allowed_chars)
+        key = None
+        if self.cache_dir is not None:
+            #only the fonts that draw the allowed chars matter
+            fonts = set([self.font_index[ord(c)] for c in self.template_chars if ord(c) in self.font_index])
+            digests = sorted([self.font_digest(self.font_paths[fn]) for fn in fonts])
+            key = cache.make_key(__name__, digests, self.width, self.height, "".join(self.template_chars))
+            path = cache.cache_path(self.cache_dir, "templates", key, ".npy")
+            stack = cache.load_npy(path)
+            if stack is not None:
+                self.set_templates(stack, key)
+                return
         #draw chars and conver to numpy arrays
-        for char in self.allowed_chars:
+        arrays = []
+        for char in self.template_chars:
             img, widths = self.draw_string(char)
-            arr = np.array(img)
-            self.char_arrays[char] = arr
+            arrays.append(np.array(img))
+        stack = comparisons.stack_arrays(arrays, max([arr.shape[1] for arr in arrays]))
+        if self.cache_dir is not None:
+            cache.save_npy(path, stack)
+        self.set_templates(stack, key)
 
-    def draw_string(self, string, unknown_char=' '):
+    def set_templates(self, stack, key=None):
         """
-        [0] unknown_char is drawn if none of the fonts support a character
-        [1] if none of the fonts support unknown_char, 0x20 (space) is drawn
-        [2] if unknown_char is a whitespace character or length 0, 0x20 (space) is drawn
+        [0] only the index and the width unknown arrays get padded to are kept, the index holds whatever form of the
+            templates its comparison needs (so with HAMMING the grayscale stack can be freed once it's packed)
+        [1] key is the templates' cache key, if they are cached the float arrays the comparison needs are too
+        """
+        self.template_width = stack.shape[2]
+        prepared = None
+        if key is not None and self.comparison in comparisons.template_preparations:
+            prepared = self.load_prepared(stack, key)
+        self.template_index = comparisons.template_index(self.comparison, stack, self.candidates, prepared)
+
+    def load_prepared(self, stack, key):
+        """
+        Returns what the comparison needs of the templates (comparisons.template_preparations), memory-mapped from self.cache_dir
+        [0] worked out and saved first if it isn't there, then loaded back so this process shares the pages too
+        [1] every array is its own .npy file (npz can't be memory-mapped), written last to first so that
+            the first one existing means they all do
+        """
+        prepare = comparisons.template_preparations[self.comparison]
+        def path(i):
+            return cache.cache_path(self.cache_dir, "%s-%s" % (prepare.__name__, i), key, ".npy")
+        if cache.load_npy(path(0)) is None:
+            arrays = prepare(stack)
+            for i in reversed(range(len(arrays))):
+                cache.save_npy(path(i), arrays[i])
+        prepared = []
+        while True:
+            array = cache.load_npy(path(len(prepared)))
+            if array is None:
+                return tuple(prepared)
+            prepared.append(array)
+
+    def build_font_index(self):
+        """
+        Maps every supported ord to the font it gets drawn with
+        [0] if several fonts support an ord, the font supporting the most ords overall is used
+        """
+        self.font_index = {}
+        #smallest fonts first so larger fonts overwrite them
+        for fn in sorted(self.font_names, key=lambda fn: (len(self.font_points[fn]), fn)):
+            self.font_index.update(dict.fromkeys(self.font_points[fn], fn))
+
+    def split_string(self, string, unknown_char):
+        """
+        Splits string between fonts using self.font_index
+        Returns [font name, string] pairs where characters drawn with other fonts are replaced by spaces
+        """
+        unknown_font = None
+        if len(unknown_char) == 1 and len(unknown_char.split()) != 0: #not whitespace
+            unknown_font = self.font_index.get(ord(unknown_char))
+        font_strings = {}
+        for i, s in enumerate(string):
+            fn = self.font_index.get(ord(s))
+            if fn is None:
+                if unknown_font is None:
+                    continue
+                fn, s = unknown_font, unknown_char
+            if fn not in font_strings:
+                font_strings[fn] = [" "] * len(string)
+            font_strings[fn][i] = s
+        return [[fn, "".join(chars)] for fn, chars in font_strings.items()]
+
+    def font_object(self, font_name):
+        """
+        Returns this thread's PIL font object for font_name
+        [0] FreeType faces aren't safe to draw with from several threads at once, so every
+            thread other than the one that loaded the fonts creates its own when it first needs them
+        """
+        fonts = self.thread_font_objects()
+        if font_name not in fonts:
+            fonts[font_name] = ImageFont.truetype(self.font_paths[font_name], self.font_sizes[font_name])
+        return fonts[font_name]
+
+    def thread_font_objects(self):
+        fonts = getattr(self.local, 'font_objects', None)
+        if fonts is None:
+            fonts = self.local.font_objects = {}
+        return fonts
+
+    def measure_string(self, string, to_use):
+        """
+        Returns (width, x offset) for each character of string, where width is the widest any font draws it (at least self.width)
+        Also adds zero-width non-joiners between the characters in to_use for fonts that support it
         """
-        ords_set = set([ord(s) for s in string])
-        to_use = []
-        fonts = [(f, self.font_points[f]) for f in self.font_names]
-        #split characters in strings between fonts
-        while len(ords_set) != 0:
-            fonts.sort(key=self.sort_key(ords_set), reverse=True)
-            font = fonts[0]
-            shared_chars = ords_set.intersection(font[1])
-            if len(shared_chars) == 0:
-                fonts.sort(key=self.sort_key(set([unknown_char])), reverse=True)
-                font = fonts[0]
-                shared_chars = ords_set.intersection(font[1])
-                if len(shared_chars) == 0 or (len(unknown_char.split()) == 0 and len(unknown_char) != 0): #eg whitespace
-                    ords_set.clear()
-                    break
-                else:
-                    ords_set.clear()
-                    temp_str = "".join([unknown_char if ord(s) in shared_chars else " " for s in string])
-                    to_use.append([font[0], temp_str])
-            else:
-                shared_chars = ords_set.intersection(font[1])
-                ords_set -= shared_chars
-                temp_str = "".join([s if ord(s) in shared_chars else " " for s in string])
-                to_use.append([font[0], temp_str])
         #get total width of string
         max_widths = [self.width] * len(string)
         for tu in to_use:
@@ -172,7 +520,7 @@ class Normalise:
                 extra = [self.width] * (len(string)-len(widths))
                 widths += extra
             max_widths = [max(widths[i], max_widths[i]) for i in range(len(max_widths))]
-        max_widths = [(max_widths[i], sum(max_widths[:i])) for i in range(len(max_widths))]
+        max_widths = list(zip(max_widths, [0] + list(itertools.accumulate(max_widths))[:-1]))
         #add zero-wdith non-joiner to strings whose fonts support it
         #this is so that every character is in its isolated form
         for i in range(len(to_use)):
@@ -182,13 +530,27 @@ class Normalise:
                 new_string = "".join(new_string_list)
                 new_string = new_string[:-1]
                 to_use[i][1] = new_string
+        return max_widths
+
+    def draw_string(self, string, unknown_char=' '):
+        """
+        [0] unknown_char is drawn if none of the fonts support a character
+        [1] if none of the fonts support unknown_char, 0x20 (space) is drawn
+        [2] if unknown_char is a whitespace character or length 0, 0x20 (space) is drawn
+        [3] characters of monospace fonts get whole self.width cells (see monospace_widths)
+        """
+        #split characters in strings between fonts
+        to_use = self.split_string(string, unknown_char)
+        for tu in to_use:
+            self.load_font(tu[0])
+        max_widths = self.measure_string(string, to_use)
         #get canvas
         str_width = max_widths[-1][0] + max_widths[-1][1]
         str_blank = Image.new("L", (str_width, self.height), color=255)
         str_draw = ImageDraw.Draw(str_blank)
         #draw on canvas
         for tu in to_use:
-            str_draw.text((0,0), tu[1], 0, font=self.font_objects[tu[0]])
+            str_draw.text((0,0), tu[1], 0, font=self.font_object(tu[0]))
         #debug
         if self.debug and not self.is_startup:
             for mw in max_widths:
@@ -198,113 +560,167 @@ class Normalise:
             print("Text image saved as: %s" % filename)
         return str_blank, max_widths
 
-    def sort_key(self, ord_set):
-        def key(tup):
-            return (len(ord_set.intersection(tup[1])), len(tup[1]))
-        return key
+    def render_char(self, char):
+        """
+        Draws a single character on its own and returns it as an array
+        """
+        img, widths = self.draw_string(char)
+        return np.array(img)
+
+    def learn_chars(self, ords):
+        """
+        Works out what each ord normalises to using image comparison, and adds it to the known normalisations
+        Returns {ord: normalised char} ("" for removed ords)
+        [0] every character is drawn on its own (never the whole text) and compared in one go
+        [1] drawings aren't cached, a character is only drawn again if another thread is learning it at the same time
+        """
+        ords = list(ords)
+        if self.instrument:
+            self.stats.add_imaging(0, len(ords))
+        if self.font_dir is None:
+            #only a compiled table, it covers everything its fonts support so the rest would all be drawn blank
+            chars = [self.table['default']] * len(ords)
+        else:
+            if self.instrument:
+                self.stats.add_glyphs(len(ords), len(ords))
+            chars = self.compare_char_arrays([self.render_char(chr(o)) for o in ords])
+        known_dict = {o:char for o,char in zip(ords, chars) if char != ""}
+        known_removal = set([o for o,char in zip(ords, chars) if char == ""])
+        self.update_known(known_dict, known_removal)
+        return dict(zip(ords, chars))
 
     def compare_char_array(self, array):
+        return self.compare_char_arrays([array])[0]
+
+    def compare_char_arrays(self, arrays):
+        """
+        Returns the closest allowed char for each array
+        [0] arrays are padded with white or cropped to the template width so the dimensions match
+        [1] every array is compared against every template (or the candidates picked for it) in a single distance matrix
+        """
+        stack = comparisons.stack_arrays(arrays, self.template_width)
+        return [self.template_chars[i] for i in self.template_index.nearest(stack)]
+
+    def build_tables(self):
+        """
+        Compiles the per-character stages into lazily filled str.translate tables
+        [0] 'chars' is every stage from remove_illegal_chars to normalise_known fused into one table
+        [1] 'pre' and 'post' are the stages before and after normalise_LINE_emojis, which can't be
+            in a table since LINE emojis depend on the characters around them
+        [2] update_known replaces the tables that depend on the known normalisations when new ones are learned
+        [3] self.stable_chars is used by fast_path, and self.stable_table (the same chars for classify) by normalise_many
+        """
+        combining = TranslationTable(self.combining_char)
+        #latin with diacritics (names, addresses) is most of what gets decomposed
+        combining.prefill(itertools.chain(range(0x00C0, 0x0250), range(0x1E00, 0x1F00)))
+        pre_funcs = (self.illegal_char, self.whitespace_char, lambda c: combining[ord(c)], self.control_char)
+        post_funcs = (self.emoji_char, self.known_char)
+        self.tables = {'illegal': TranslationTable(self.illegal_char),
+                       'combining': combining,
+                       'whitespace': TranslationTable(self.whitespace_char),
+                       'control': TranslationTable(self.control_char),
+                       'emoji': TranslationTable(self.emoji_char),
+                       'known': TranslationTable(self.known_char),
+                       'pre': TranslationTable(lambda c: chain_chars(c, pre_funcs)),
+                       'post': TranslationTable(lambda c: chain_chars(c, post_funcs)),
+                       'chars': TranslationTable(lambda c: chain_chars(c, pre_funcs + post_funcs))}
+        #ascii chars no stage changes, texts made only of these just need whitespace collapsing and lowercasing
+        self.stable_chars = frozenset([c for c in self.allowed_chars if c.isascii() and c.translate(self.tables['chars']) == c])
+        #for classifying big batches all at once, update_known replaces it along with stable_chars
+        self.stable_table = classify.build_stable_table(self.stable_chars) if np is not None else None
+
+    def normalise_chars(self, text):
         """
-        Arrays MUST HAVE THE SAME DIMENSIONS or this will not work
+        Same as running every stage from remove_illegal_chars to normalise_known in order, but in a single str.translate call
+        Falls back to pre table -> normalise_LINE_emojis -> post table if the text has any LINE emoji characters
         """
-        results = []
-        for c in self.char_arrays.keys():
-            c_arr = self.char_arrays[c]
-            s = self.comparison(array, c_arr)
-            results.append((c, s))
-        results.sort(key=lambda x: x[1])
-        return results[0][0]
+        tables = self.tables #one snapshot, update_known may replace self.tables meanwhile
+        if text and max(text) > chr(983040):
+            text = text.translate(tables['pre'])
+            text = self.normalise_LINE_emojis(text)
+            return text.translate(tables['post'])
+        return text.translate(tables['chars'])
+
+    def control_char(self, char):
+        o = ord(char)
+        if o in self.allowed_control_chars:
+            return self.allowed_control_chars[o]
+        if unicodedata.category(char) in ['Cc','Cf','Sk']:
+            return ""
+        return char
 
     def remove_control_chars(self, text):
         """
         Removes control, format, and modifier characters
         Not including modifier letters or allowed control characters
         """
-        set_text = set(text)
-        #Im assuming acc.keys() will in general be shorter than set_text
-        for acck in self.allowed_control_chars.keys():
-            if acck in set_text:
-                text = text.replace(acck, self.allowed_control_chars[acck])
-        to_remove = []
-        for i in range(len(text)):
-            if unicodedata.category(text[i]) in ['Cc','Cf','Sk']:
-                to_remove.append(i)
-        to_remove.reverse()
-        for tr in to_remove:
-            text = text[:i] + text[i+1:]
+        text = text.translate(self.tables['control'])
         if self.debug:
             print("Control chars: %s" % text)
         return text
 
+    def illegal_char(self, char):
+        o = ord(char)
+        if unicodedata.category(char) in ['Cs','Cn'] or o in self.private_use_chars:
+            if o not in [1114110, 1114111]: #used for LINE emojis
+                return ""
+        return char
+
     def remove_illegal_chars(self, text):
         """
         Removes surrogate and unassigned characters
         I realise that this function can be combined with the function above
         I have left it like this for readability
         """
-        to_remove = []
-        for i in range(len(text)):
-            if unicodedata.category(text[i]) in ['Cs','Cn'] or ord(text[i]) in self.private_use_chars:
-                if ord(text[i]) not in [1114110, 1114111]: #used for LINE emojis
-                    to_remove.append(i)
-        to_remove.reverse()
-        for tr in to_remove:
-            text = text[:i] + text[i+1:]
+        text = text.translate(self.tables['illegal'])
         if self.debug:
             print("Illegal chars: %s" % text)
         return text
 
+    def combining_char(self, char):
+        """
+        Returns char with its marks removed, after compatibility and canonical decomposition
+        [0] punctuation is removed from the decomposition of characters that aren't punctuation themselves
+        [1] results are cached per character in self.tables['combining']
+        """
+        if unicodedata.category(char)[0] == 'M':
+            return ""
+        ss_list = []
+        for n in unicodedata.normalize("NFKD",char): #compatibility
+            nfd = unicodedata.normalize("NFD",n) #canonical equivalence
+            if unicodedata.category(n)[0] != 'P':
+                nfd = [c for c in nfd if unicodedata.category(c)[0] != 'P']
+            ss_list += nfd
+        return "".join([s for s in ss_list if unicodedata.category(s)[0] != 'M'])
+
     def remove_combining_chars(self, text):
         """
         Removes marks
         Really should be named remove_marks, but this is what i originally named it
         """
-        i = 0
-        lentext = len(text)
-        while i < lentext:
-            ss = text[i] #substring
-            if unicodedata.category(ss)[0] == 'M':
-                text = text[:i] + text[i+1:]
-            else:
-                nfkd_list = list(unicodedata.normalize("NFKD",ss)) #compatibility
-                ss_list = []
-                for n in nfkd_list:
-                    nfd = list(unicodedata.normalize("NFD",n)) #canonical equivalence
-                    if unicodedata.category(n)[0] != 'P':
-                        for nfd_char in nfd:
-                            if unicodedata.category(nfd_char)[0] == 'P':
-                                nfd.remove(nfd_char)
-                    ss_list += nfd
-                for s in ss_list:
-                    if unicodedata.category(s) == 'M':
-                        ss_list.remove(s)
-                new_ss = "".join(ss_list)
-                text = text[:i] + new_ss + text[i+1:]
-                i += len(new_ss)
-            lentext = len(text)
+        text = text.translate(self.tables['combining'])
         if self.debug:
             print("Combining chars: %s" % text)
         return text
 
+    def emoji_char(self, char, replacement=" ", remove=True):
+        o = ord(char)
+        if o in self.emoji_ords:
+            if o in self.allowed_emojis:
+                return self.allowed_emojis[o]
+            elif remove == True:
+                return replacement
+        return char
+
     def normalise_emojis(self, text, replacement=" ", remove=True):
         """
         Converts allowed emojis
         Removes all other emojis
         """
-        i = 0
-        lentext = len(text)
-        while i < lentext:
-            o = ord(text[i])
-            if o in self.emoji_ords:
-                if o in self.allowed_emojis.keys():
-                    text = text[:i] + self.allowed_emojis[o] + text[i+1:]
-                    i += len(self.allowed_emojis[o])
-                elif remove == True:
-                    text = text[:i] + replacement + text[i+1:]
-                    i += len(replacement)
-                lentext = len(text)
-            else:
-                i += 1
+        if replacement == " " and remove == True:
+            text = text.translate(self.tables['emoji'])
+        else:
+            text = self.emoji_regex.sub(lambda m: self.emoji_char(m.group(), replacement, remove), text)
         if self.debug:
             print("Emojis: %s" % text)
         return text
@@ -319,138 +735,185 @@ class Normalise:
             or replaces them with replacement string
         remove == 2:
             replaces all LINE emojis with replacement string
+        [0] every LINE emoji is found by one pass of LINE_EMOJI_REGEX, and what replaces it isn't looked at again
         """
-        i = 0
-        lentext = len(text)
-        while i < lentext:
-            if ord(text[i]) > 983040: #supplementary private use unicode points
-                e = text.find(chr(1114111), i)
-                if e in [-1, i]:
-                    text = text[:i] + text[i+1:]
-                else:
-                    start, mid, end = text[:i], text[i:e+1], text[e+1:]
-                    emoji_ids = [m for m in mid if ord(m) >= 983040]
-                    mid = [m for m in mid if ord(m) < 983040]
-                    mid = "".join(mid)
-                    if remove == 2:
-                        text = start + replacement + end
-                        i += len(replacement)
-                    elif len(mid) > 2:
-                        try:
-                            mid = w2n.word_to_num(mid)
-                            text = start + mid +end
-                        except:
-                            if emoji_ids[0] == 1050625 and emoji_ids[1] in range(1048833, 1048948):
-                                text = start + mid + end
-                            elif emoji_ids[0] == 1056769 and emoji_ids[1] in range(1048966, 1049040):
-                                if emoji_ids[1] == 1049036:
-                                    mid = "13"
-                                text = start + mid + end
-                            #not sure why i have this next elif but id just leave it
-                            elif mid in ['oz.','ml.']:
-                                text = start + mid + end
-                            elif remove == 1:
-                                mid = replacement
-                                text = start + replacement + end
-                            else:
-                                mid += "".join(emoji_ids)
-                        i += len(mid)
-                    elif remove == 1:
-                        text = start + replacement + end
-                        i += len(replacement)
-                lentext = len(text)
-            else:
-                i += 1
+        text = LINE_EMOJI_REGEX.sub(lambda m: self.LINE_emoji(m.group(), replacement, remove), text)
         if self.debug:
             print("LINE emojis: %s" % text)
         return text
 
+    def LINE_emoji(self, sequence, replacement, remove):
+        """
+        Returns what a LINE emoji sequence (see LINE_EMOJI_REGEX) gets replaced with
+        """
+        if len(sequence) == 1:
+            return ""
+        emoji_ids = [ord(m) for m in sequence if ord(m) >= 983040]
+        mid = "".join([m for m in sequence if ord(m) < 983040])
+        if remove == 2:
+            return replacement
+        elif len(mid) > 2:
+            number = word_to_num(mid)
+            if number is not None:
+                return number
+            if emoji_ids[0] == 1050625 and emoji_ids[1] in range(1048833, 1048948):
+                return mid
+            elif emoji_ids[0] == 1056769 and emoji_ids[1] in range(1048966, 1049040):
+                if emoji_ids[1] == 1049036:
+                    return "13"
+                return mid
+            #not sure why i have this next elif but id just leave it
+            elif mid in ['oz.','ml.']:
+                return mid
+        if remove == 1:
+            return replacement
+        return sequence
+
+    def whitespace_char(self, char):
+        if ord(char) in self.whitespace_extra:
+            return ""
+        #Zl, Zp, and Zs categories (Cc whitespace chars get removed as control chars)
+        if unicodedata.category(char)[0] == 'Z':
+            return " " #space chr(32) 0x20
+        return char
+
     def normalise_whitespace(self, text):
         """
         Removes whitespace extra characters (not true whitespace)
         Converts all other whitespace characters into spaces (0x20)
         """
-        to_remove = []
-        for i in range(len(text)):
-            if ord(text[i]) in self.whitespace_extra:
-                to_remove.append(i)
-        to_remove.reverse()
-        for tr in to_remove:
-            text = text[:i] + text[i+1:]
-        for char in text:
-            #Zl, Zp, and Zs categories (Cc whitespace chars get removed as control chars)
-            if unicodedata.category(char)[0] == 'Z':
-                text = text.replace(char, ' ') #space chr(32) 0x20
+        text = text.translate(self.tables['whitespace'])
         if self.debug:
             print("Whitespace: %s" % text)
         return text
 
+    def known_char(self, char):
+        o = ord(char)
+        if o in self.known_normalisations:
+            return self.known_normalisations[o]
+        if o in self.known_removal:
+            return ""
+        return char
+
+    def known_chars(self, text):
+        """
+        Returns the characters of text that aren't allowed chars but are in the known normalisations or known removal
+        """
+        known_normalisations, known_removal = self.known_normalisations, self.known_removal
+        return set([c for c in set(text) - self.allowed_chars if ord(c) in known_normalisations or ord(c) in known_removal])
+
     def normalise_known(self, text):
         """
         Converts extra keys to extra values
         Should probably be merged with normalise_known at some point
         """
-        set_text = set(text)
-        to_remove = []
-        #Im assuming kn.keys() will in general be longer than set_text
-        for st in set_text:
-            if ord(st) in self.known_normalisations.keys():
-                text = text.replace(st, self.known_normalisations[ord(st)])
-        #Im assuming self.kr will in general be longer than set_text
-        for i in range(len(text)):
-            if ord(text[i]) in self.known_removal:
-                to_remove.append(i)
-        to_remove.reverse()
-        for tr in to_remove:
-            text = text[:i] + text[i+1:]
+        text = text.translate(self.tables['known'])
         if self.debug:
             print("Known: %s" % text)
         return text
 
     def update_known(self, known_dict, known_set):
-        self.known_normalisations.update(known_dict)
-        self.known_removal |= known_set
-        #maybe add some stuff to save it to database too
+        """
+        Adds learned normalisations
+        [0] the known normalisations and the tables built from them are replaced, never changed in place,
+            so threads in the middle of normalising keep using a consistent snapshot
+        [1] concurrent calls are serialised, and so are database writes
+        """
+        with self.lock:
+            known_normalisations = dict(self.known_normalisations)
+            known_normalisations.update(known_dict)
+            changed = set(known_dict.keys()) | known_set
+            tables = dict(self.tables)
+            for name in ['known', 'post', 'chars']:
+                tables[name] = tables[name].without(changed)
+            self.known_normalisations = known_normalisations
+            self.known_removal = self.known_removal | known_set
+            self.tables = tables
+            self.stable_chars = self.stable_chars - set([chr(o) for o in changed])
+            if self.stable_table is not None:
+                self.stable_table = classify.build_stable_table(self.stable_chars)
+            if self.db is None:
+                return
+            #db is ord:ord, so only single character normalisations get saved
+            self.db_pending_normalisations.update({k:v for k,v in known_dict.items() if len(v) == 1})
+            self.db_pending_removal |= known_set
+            if len(self.db_pending_normalisations) + len(self.db_pending_removal) >= self.db_batch_size:
+                self.flush_db()
 
-    def normalise(self, text):
-        text = self.remove_illegal_chars(text)
-        text = self.normalise_whitespace(text)
-        #whitespace first because control removes some whitespace chars
-        text = self.remove_combining_chars(text)
-        text = self.remove_control_chars(text)
-        text = self.normalise_LINE_emojis(text)
-        text = self.normalise_emojis(text)
-        text = self.normalise_known(text)
+    def timed_stage(self, stage, stage_func, text, table=None):
+        """
+        Runs stage_func on text and records how long it took and what it changed
+        [0] if the stage has a translation table the changes are counted exactly, otherwise
+            only the drop in length is counted (as removed characters)
+        """
+        start = time.perf_counter()
+        new_text = stage_func(text)
+        seconds = time.perf_counter() - start
+        if table is not None:
+            removed, replaced = count_changes(text, table)
+        else:
+            removed, replaced = max(len(text)-len(new_text), 0), 0
+        self.stats.add_stage(stage, seconds, removed, replaced)
+        if self.stats_callback is not None:
+            self.stats_callback(stage, seconds, removed, replaced)
+        return new_text
+
+    def normalise_stages(self, text):
+        """
+        Runs every stage before imaging
+        """
+        if self.debug:
+            #run every stage separately so each one gets printed
+            text = self.remove_illegal_chars(text)
+            text = self.normalise_whitespace(text)
+            #whitespace first because control removes some whitespace chars
+            text = self.remove_combining_chars(text)
+            text = self.remove_control_chars(text)
+            text = self.normalise_LINE_emojis(text)
+            text = self.normalise_emojis(text)
+            text = self.normalise_known(text)
+        elif self.instrument:
+            #every stage separately so each one can be timed
+            self.stats.add_text()
+            tables = self.tables
+            text = self.timed_stage('illegal', self.remove_illegal_chars, text, tables['illegal'])
+            text = self.timed_stage('whitespace', self.normalise_whitespace, text, tables['whitespace'])
+            text = self.timed_stage('combining', self.remove_combining_chars, text, tables['combining'])
+            text = self.timed_stage('control', self.remove_control_chars, text, tables['control'])
+            text = self.timed_stage('LINE_emoji', self.normalise_LINE_emojis, text)
+            text = self.timed_stage('emoji', self.normalise_emojis, text, tables['emoji'])
+            self.stats.add_imaging(len(self.known_chars(text)), 0)
+            text = self.timed_stage('known', self.normalise_known, text, tables['known'])
+        else:
+            text = self.normalise_chars(text)
 
         #get rid of multiple spaces
         texts = text.split()
-        text = " ".join(texts)
+        return " ".join(texts)
 
-        #normalise using imaging methods
-        unknown_chars = {} # uc[ord] = index
-        for i in range(len(text)):
-            if text[i] not in self.allowed_chars:
-                unknown_chars[ord(text[i])] = i
-        if unknown_chars != {}:
-            #could just not draw whole text string, but not sure if i wanna split it in weird spots
-            text_image, widths = self.draw_string(text)
-            unknown_char_arrays = {}
-            for uc_ord in unknown_chars.keys():
-                uc_i = unknown_chars[uc_ord]
-                coordinates = (widths[uc_i][1], 0, sum(widths[uc_i]), self.height) #LURD
-                sub_img = text_image.crop(box=coordinates)
-                sub_arr = np.array(sub_img)
-                unknown_char_arrays[uc_ord] = sub_arr
-            known_removal = []
-            for uc_ord in unknown_char_arrays.keys():
-                char = self.compare_char_array(unknown_char_arrays[uc_ord])
-                if char == "":
-                    known_removal.append(uc_ord)
-                    del unknown_char_arrays[uc_ord]
-                else:
-                    unknown_char_arrays[uc_ord] = char
-            self.update_known(unknown_char_arrays, set(known_removal))
-            text = self.normalise_known(text)
+    def imaging_stage(self, texts):
+        """
+        Normalises every character in texts that isn't an allowed char using imaging methods
+        [0] only the characters just learned get translated, and only in the texts that have them, since
+            everything else was already normalised by the stages (translating it again could change it twice)
+        """
+        unknown_chars = set().union(*texts) - self.allowed_chars
+        if len(unknown_chars) == 0:
+            return texts
+        start = time.perf_counter()
+        learned = TranslationTable(lambda c: c)
+        learned.update(self.learn_chars([ord(c) for c in unknown_chars]))
+        new_texts = [text if unknown_chars.isdisjoint(text) else text.translate(learned) for text in texts]
+        if self.instrument:
+            seconds = time.perf_counter() - start
+            changes = [count_changes(text, learned) for text in texts if not unknown_chars.isdisjoint(text)]
+            removed, replaced = sum([c[0] for c in changes]), sum([c[1] for c in changes])
+            self.stats.add_stage('imaging', seconds, removed, replaced)
+            if self.stats_callback is not None:
+                self.stats_callback('imaging', seconds, removed, replaced)
+        return new_texts
+
+    def finish(self, text):
         if self.debug:
             print("Imaging: %s" % text)
 
@@ -459,3 +922,64 @@ class Normalise:
         text = " ".join(texts)
         text = text.lower()
         return text
+
+    def fast_path(self, text):
+        """
+        Returns True if text is ascii made only of self.stable_chars, so every stage before finish can be skipped
+        [0] never taken in debug mode, so every stage still gets printed
+        """
+        if self.debug or not text.isascii() or not self.stable_chars.issuperset(text):
+            return False
+        if self.instrument:
+            self.stats.add_fast_path()
+        return True
+
+    def unstable_texts(self, texts):
+        """
+        Returns a list of bools, True for each text that can't take fast_path (ignoring debug mode)
+        [0] only ascii texts can be stable, so non-ascii ones are never looked at any further
+        [1] the ascii texts are classified all at once with numpy if there are at least CLASSIFY_MIN_BATCH of them
+            averaging at least CLASSIFY_MIN_LENGTH characters, otherwise one at a time (see classify.py for timings)
+        """
+        stable_chars, stable_table = self.stable_chars, self.stable_table #one snapshot, update_known may replace them
+        is_ascii = [text.isascii() for text in texts]
+        ascii_texts = list(itertools.compress(texts, is_ascii))
+        if (stable_table is not None and len(ascii_texts) >= CLASSIFY_MIN_BATCH
+                and sum(map(len, ascii_texts)) >= CLASSIFY_MIN_LENGTH * len(ascii_texts)):
+            unstable = classify.unstable_texts(stable_table, ascii_texts).tolist()
+        else:
+            unstable = [not stable_chars.issuperset(text) for text in ascii_texts]
+        unstable = iter(unstable)
+        return [next(unstable) if a else True for a in is_ascii]
+
+    def normalise(self, text):
+        if self.fast_path(text):
+            return self.finish(text)
+        text = self.normalise_stages(text)
+        text = self.imaging_stage([text])[0]
+        return self.finish(text)
+
+    def normalise_many(self, texts):
+        """
+        Normalises every text in texts (any iterable), returning a list
+        [0] unknown characters are gathered across all the texts first, so each distinct one
+            is drawn and compared once and the known normalisations are only updated once
+        [1] the results are the same as calling normalise on each text
+        [2] the texts that can take the fast path are found with unstable_texts, all at once for big batches of longer ascii texts
+        """
+        texts = list(texts)
+        if not self.debug:
+            fast = [not u for u in self.unstable_texts(texts)]
+            if self.instrument:
+                self.stats.add_fast_path(sum(fast))
+        else:
+            fast = [self.fast_path(text) for text in texts]
+        slow = [self.normalise_stages(text) for text,f in zip(texts, fast) if not f]
+        slow = iter(self.imaging_stage(slow))
+        return [self.finish(text if f else next(slow)) for text,f in zip(texts, fast)]
+
+    def normalise_column(self, column):
+        """
+        Normalises a pandas Series or pyarrow string array, normalising each distinct value once (see columns.py)
+        """
+        return columns.normalise_column(self, column)
@@ -0,0 +1,135 @@
+"""
+Runs an already loaded Normalise (from normalise_all or normalise_monospace) over several processes
+"""
+import multiprocessing as mp
+import collections, itertools, os
+
+#the Normalise the workers use, set in the parent before forking so workers inherit it already loaded
+_normaliser = None
+#in a worker: how much of the pool's learned list it has added, and what it learned itself during the current chunk
+_version = 0
+_learned = {}
+
+def _init_worker():
+    #only the parent writes learned normalisations to the database
+    #the reference is kept so the forked sqlite connection never gets closed from here
+    _normaliser.forked_db, _normaliser.db = _normaliser.db, None
+    _normaliser.learn_chars = _learn_chars
+
+def _learn_chars(ords):
+    learned = type(_normaliser).learn_chars(_normaliser, ords)
+    _learned.update(learned)
+    return learned
+
+def _normalise_chunk(texts, since, learned):
+    """
+    learned is the pool's learned list from index since, which is never past what this worker has added
+    """
+    global _version
+    n = _normaliser
+    #normalisations other workers learned since this one last got a chunk
+    new = learned[_version-since:]
+    new_dict = {k:v for k,v in new if v != "" and k not in n.known_normalisations}
+    new_set = set([k for k,v in new if v == ""]) - n.known_removal
+    if len(new_dict) != 0 or len(new_set) != 0:
+        n.update_known(new_dict, new_set)
+    _version = since + len(learned)
+    _learned.clear()
+    results = n.normalise_many(texts)
+    return results, dict(_learned), os.getpid(), _version
+
+def chunks(iterable, size):
+    """
+    Yields lists of size items from iterable (the last one can be shorter), reading it lazily
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def _call_chunk(func, chunk):
+    return func(_normaliser, chunk)
+
+def map_chunks(normaliser, func, chunks, processes):
+    """
+    Returns [func(normaliser, chunk) for chunk in chunks], spread over processes forked from this one
+    [0] workers inherit normaliser already loaded, and func has to be a module level function so it can be pickled
+    """
+    global _normaliser
+    if processes == 1:
+        return [func(normaliser, chunk) for chunk in chunks]
+    _normaliser = normaliser
+    pool = mp.get_context("fork").Pool(processes)
+    try:
+        return pool.starmap(_call_chunk, [(func, chunk) for chunk in chunks], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+class NormalisePool:
+
+    def __init__(self, normaliser, processes=None, chunk_size=256):
+        """
+        [0] workers are forked from this process, so they share the loaded fonts and template arrays instead of loading their own
+        [1] normalisations a worker learns are sent back with its results, added to normaliser (and its database),
+            and sent to every worker with its next chunk so the same character is never learned twice
+        [2] a chunk only carries what was learned since the worker that is furthest behind last reported back,
+            any worker can take it and skips the part it already has
+        [3] fork isn't available on Windows
+        """
+        global _normaliser
+        assert (type(chunk_size) == int and chunk_size > 0), "chunk_size must be a positive integer."
+        self.normaliser = normaliser
+        self.processes = processes or os.cpu_count() or 1
+        self.chunk_size = chunk_size
+        #(ord, char) for everything learned by any worker since the pool started ("" for removal), only ever appended to
+        self.learned = []
+        self.learned_ords = set([])
+        #pid -> how much of self.learned that worker had added when it last sent results
+        self.worker_versions = {}
+        _normaliser = normaliser
+        self.pool = mp.get_context("fork").Pool(self.processes, initializer=_init_worker)
+
+    def imap(self, texts):
+        """
+        Yields the normalised texts in order
+        [0] texts are read lazily and at most 2 chunks per worker are in flight, so memory use is bounded
+        """
+        pending = collections.deque()
+        for chunk in chunks(texts, self.chunk_size):
+            #a worker that hasn't sent results yet could be at the start
+            since = min(self.worker_versions.values()) if len(self.worker_versions) == self.processes else 0
+            #slicing copies, since the pool pickles task arguments in another thread
+            args = (chunk, since, self.learned[since:])
+            pending.append(self.pool.apply_async(_normalise_chunk, args))
+            while len(pending) >= 2*self.processes or (len(pending) != 0 and pending[0].ready()):
+                for text in self.merge(pending.popleft().get()):
+                    yield text
+        while len(pending) != 0:
+            for text in self.merge(pending.popleft().get()):
+                yield text
+
+    def normalise_many(self, texts):
+        return list(self.imap(texts))
+
+    def merge(self, result):
+        results, learned, pid, version = result
+        self.worker_versions[pid] = max(version, self.worker_versions.get(pid, 0))
+        new = [(k,v) for k,v in learned.items() if k not in self.learned_ords]
+        if len(new) != 0:
+            self.learned += new
+            self.learned_ords.update([k for k,v in new])
+            self.normaliser.update_known({k:v for k,v in new if v != ""}, set([k for k,v in new if v == ""]))
+        return results
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,189 @@
+"""
+Local normalisation server: python server.py [FONT_DIR] [--table TABLE] [--port 8765 | --unix PATH]
+Keeps one warm Normalise and serves it over HTTP (on localhost or a unix socket)
+[0] POST /normalise with {"text": "..."} returns {"text": "..."}, {"texts": [...]} returns {"texts": [...]}
+[1] GET /health returns {"status": "ok"}
+[2] concurrent requests are collected into micro-batches (up to --max-batch-size texts, waiting at most
+    --max-delay-ms for more) and each batch runs through normalise_many in a thread, so the event loop
+    keeps accepting requests while a batch is being drawn and compared
+"""
+from concurrent.futures import ThreadPoolExecutor
+import argparse, asyncio, json
+
+MAX_BODY_SIZE = 16 * 1024 * 1024
+
+class MicroBatcher:
+
+    def __init__(self, normaliser, max_batch_size=256, max_delay=0.005, threads=1):
+        """
+        [0] with threads > 1, that many batches can run at once (a Normalise can be shared between threads)
+        """
+        assert (type(max_batch_size) == int and max_batch_size > 0), "max_batch_size must be a positive integer."
+        assert (max_delay >= 0), "max_delay cannot be negative."
+        assert (type(threads) == int and threads > 0), "threads must be a positive integer."
+        self.normaliser = normaliser
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self.threads = threads
+        self.executor = ThreadPoolExecutor(max_workers=threads)
+        self.queue = None
+        self.tasks = []
+
+    def start(self):
+        self.queue = asyncio.Queue()
+        self.tasks = [asyncio.ensure_future(self.run()) for i in range(self.threads)]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.executor.shutdown()
+
+    async def normalise(self, text):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def next_batch(self):
+        loop = asyncio.get_running_loop()
+        batch = [await self.queue.get()]
+        deadline = loop.time() + self.max_delay
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.next_batch()
+            #requests whose client has gone away don't need normalising
+            batch = [(text, future) for text, future in batch if not future.done()]
+            if len(batch) == 0:
+                continue
+            try:
+                results = await loop.run_in_executor(self.executor, self.normaliser.normalise_many, [text for text, future in batch])
+            except Exception as e:
+                for text, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (text, future), result in zip(batch, results):
+                if not future.done():
+                    future.set_result(result)
+
+class NormaliseServer:
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def respond(self, method, path, body):
+        """
+        Returns (status code, JSON payload)
+        """
+        if path == "/health":
+            return 200, {"status": "ok"}
+        if path != "/normalise":
+            return 404, {"error": "not found"}
+        if method != "POST":
+            return 405, {"error": "use POST"}
+        try:
+            request = json.loads(body.decode("utf-8"))
+        except ValueError:
+            return 400, {"error": "body must be JSON"}
+        if isinstance(request, dict) and isinstance(request.get("text"), str):
+            return 200, {"text": await self.batcher.normalise(request["text"])}
+        if isinstance(request, dict) and isinstance(request.get("texts"), list) and all([isinstance(t, str) for t in request["texts"]]):
+            texts = await asyncio.gather(*[self.batcher.normalise(t) for t in request["texts"]])
+            return 200, {"texts": list(texts)}
+        return 400, {"error": "body must have a \"text\" string or a \"texts\" list of strings"}
+
+    async def handle(self, reader, writer):
+        reasons = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed", 413: "Payload Too Large", 500: "Internal Server Error"}
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line:
+                    break
+                method, path, version = request_line.decode("latin-1").split()
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b"\r\n", b"\n", b""):
+                        break
+                    k, v = line.decode("latin-1").split(":", 1)
+                    headers[k.strip().lower()] = v.strip()
+                length = int(headers.get("content-length", 0))
+                if length > MAX_BODY_SIZE:
+                    status, payload, keep_alive = 413, {"error": "body too large"}, False
+                else:
+                    body = await reader.readexactly(length)
+                    try:
+                        status, payload = await self.respond(method, path, body)
+                    except Exception as e:
+                        status, payload = 500, {"error": str(e)}
+                    keep_alive = version == "HTTP/1.1" and headers.get("connection", "").lower() != "close"
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(("HTTP/1.1 %s %s\r\nContent-Type: application/json\r\nContent-Length: %s\r\n%s\r\n"
+                              % (status, reasons[status], len(data), "" if keep_alive else "Connection: close\r\n")).encode("latin-1") + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ValueError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+async def serve(normaliser, host="127.0.0.1", port=8765, unix_path=None, max_batch_size=256, max_delay=0.005, threads=1):
+    batcher = MicroBatcher(normaliser, max_batch_size=max_batch_size, max_delay=max_delay, threads=threads)
+    batcher.start()
+    server = NormaliseServer(batcher)
+    if unix_path is not None:
+        listener = await asyncio.start_unix_server(server.handle, path=unix_path)
+        print("Serving on %s" % unix_path)
+    else:
+        listener = await asyncio.start_server(server.handle, host=host, port=port)
+        print("Serving on http://%s:%s" % (host, port))
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        await batcher.stop()
+
+def main(argv=None):
+    from normalise import load_normaliser
+    parser = argparse.ArgumentParser(prog="python server.py", description="Serve a warm Normalise over HTTP.")
+    parser.add_argument("font_dir", nargs="?", help="directory of .ttf fonts to use (can be left out with --table)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--unix", help="serve on this unix socket path instead of host:port")
+    parser.add_argument("--monospace", action="store_true", help="use normalise_monospace (normalise_all with the old argument order)")
+    parser.add_argument("--px-width", type=int, default=40)
+    parser.add_argument("--comparison", default="MSE", choices=["MSE", "NRMSE", "PSNR", "SSIM", "HAMMING"])
+    parser.add_argument("--db", help="sqlite database of learned normalisations")
+    parser.add_argument("--cache-dir", help="directory to cache font metrics and template arrays in")
+    parser.add_argument("--candidates", type=int, help="only fully compare this many templates, picked by a coarse comparison")
+    parser.add_argument("--lazy-fonts", action="store_true", help="only read font cmaps at startup, measure fonts when first needed")
+    parser.add_argument("--table", help="normalisation table compiled by static_table.py")
+    parser.add_argument("--max-batch-size", type=int, default=256, help="most texts normalised together (default: 256)")
+    parser.add_argument("--max-delay-ms", type=float, default=5.0, help="longest wait for a batch to fill (default: 5)")
+    parser.add_argument("--threads", type=int, default=1, help="batches run at once (default: 1)")
+    args = parser.parse_args(argv)
+    if args.font_dir is None and args.table is None:
+        parser.error("give a font_dir, a --table, or both")
+    normaliser = load_normaliser(args)
+    try:
+        asyncio.run(serve(normaliser, host=args.host, port=args.port, unix_path=args.unix, max_batch_size=args.max_batch_size,
+                          max_delay=args.max_delay_ms / 1000.0, threads=args.threads))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        normaliser.close_db()
+
+if __name__ == "__main__":
+    main()
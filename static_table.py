@@ -0,0 +1,74 @@
+"""
+Compiles a static normalisation table: python static_table.py FONT_DIR -o table.json [--workers N]
+[0] imaging only depends on the fonts, px_width, comparison and allowed chars, so every character the fonts support
+    can be drawn and compared once ahead of time and the results saved as ord -> replacement
+[1] Normalise(table_path=...) loads the table so none of those characters are ever drawn, and with font_dir=None
+    it doesn't need PIL, numpy or fontTools at all (see normalise_all.Normalise.load_table)
+[2] the table is JSON, so loading it only needs the standard library
+"""
+from parallel import chunks, map_chunks
+import argparse, io, itertools, json, os
+
+TABLE_VERSION = 1
+
+def _compare_chunk(n, ords):
+    return n.compare_char_arrays([n.render_char(chr(o)) for o in ords])
+
+def compile_table(normaliser, processes=None, chunk_size=512):
+    """
+    Draws and compares every character normaliser's fonts support (except allowed chars) and returns the table
+    [0] characters are drawn on their own in chunks of chunk_size, spread over processes forked from this one
+    [1] 'default' is what a character no font supports normalises to (it gets drawn as a blank cell)
+    """
+    import numpy as np
+    assert (normaliser.font_dir is not None), "normaliser must have fonts to compile a table."
+    assert (type(chunk_size) == int and chunk_size > 0), "chunk_size must be a positive integer."
+    allowed_ords = set([ord(c) for c in normaliser.allowed_chars])
+    ords = sorted(set(normaliser.font_index) - allowed_ords)
+    processes = processes or os.cpu_count() or 1
+    results = map_chunks(normaliser, _compare_chunk, list(chunks(ords, chunk_size)), processes)
+    chars = list(itertools.chain(*results))
+    blank = np.full((normaliser.height, normaliser.width), 255, dtype=np.uint8)
+    return {'version': TABLE_VERSION,
+            'profile': normaliser.db_profile,
+            'allowed_chars': "".join(sorted(normaliser.allowed_chars)),
+            'default': normaliser.compare_char_array(blank),
+            'normalisations': {o:char for o,char in zip(ords, chars) if char != ""},
+            'removal': set([o for o,char in zip(ords, chars) if char == ""])}
+
+def save_table(table, path):
+    data = dict(table)
+    data['normalisations'] = {str(o):char for o,char in sorted(table['normalisations'].items())}
+    data['removal'] = sorted(table['removal'])
+    with io.open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, sort_keys=True)
+
+def load_table(path):
+    with io.open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get('version') != TABLE_VERSION:
+        raise Exception("%s is not a version %s normalisation table." % (path, TABLE_VERSION))
+    data['normalisations'] = {int(o):char for o,char in data['normalisations'].items()}
+    data['removal'] = set(data['removal'])
+    return data
+
+def main(argv=None):
+    from normalise_all import Normalise
+    parser = argparse.ArgumentParser(prog="python static_table.py", description="Compile a static normalisation table.")
+    parser.add_argument("font_dir", help="directory of .ttf fonts to use")
+    parser.add_argument("-o", "--output", required=True, help="file to write the table to")
+    parser.add_argument("--px-width", type=int, default=40)
+    parser.add_argument("--comparison", default="MSE", choices=["MSE", "NRMSE", "PSNR", "SSIM", "HAMMING"])
+    parser.add_argument("--cache-dir", help="directory to cache font metrics and template arrays in")
+    parser.add_argument("--candidates", type=int, help="only fully compare this many templates, picked by a coarse comparison")
+    parser.add_argument("--workers", type=int, default=None, help="number of processes (default: one per CPU)")
+    parser.add_argument("--chunk-size", type=int, default=512, help="characters per task (default: 512)")
+    args = parser.parse_args(argv)
+    normaliser = Normalise(font_dir=args.font_dir, px_width=args.px_width, comparison=args.comparison, cache_dir=args.cache_dir,
+                           candidates=args.candidates)
+    table = compile_table(normaliser, processes=args.workers, chunk_size=args.chunk_size)
+    save_table(table, args.output)
+    print("Wrote %s normalisation(s) to %s." % (len(table['normalisations']) + len(table['removal']), args.output))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+"""
+Counters and timings collected by a Normalise created with instrument=True
+"""
+import threading
+
+STAGES = ['illegal', 'whitespace', 'combining', 'control', 'LINE_emoji', 'emoji', 'known', 'imaging']
+
+class NormaliseStats:
+    """
+    [0] time is wall time in seconds per stage, removed and replaced are numbers of characters per stage
+    [1] imaging_hits counts the characters imaging would have been needed for that were already known (learned before,
+        from the database or from a compiled table), once per text. imaging_misses counts the characters sent to
+        Normalise.learn_chars, once per batch
+    [2] glyphs_rendered counts unknown characters drawn, glyphs_compared the ones compared against the templates
+        (neither counts characters a table-only Normalise gives its default)
+    [3] fast_path_hits counts the texts (included in texts) that took Normalise.fast_path and skipped every stage
+    [4] safe to update from several threads
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.texts = 0
+            self.fast_path_hits = 0
+            self.time = dict.fromkeys(STAGES, 0.0)
+            self.removed = dict.fromkeys(STAGES, 0)
+            self.replaced = dict.fromkeys(STAGES, 0)
+            self.imaging_hits = 0
+            self.imaging_misses = 0
+            self.glyphs_rendered = 0
+            self.glyphs_compared = 0
+
+    def add_text(self):
+        with self.lock:
+            self.texts += 1
+
+    def add_fast_path(self, texts=1):
+        with self.lock:
+            self.texts += texts
+            self.fast_path_hits += texts
+
+    def add_stage(self, stage, seconds, removed, replaced):
+        with self.lock:
+            self.time[stage] += seconds
+            self.removed[stage] += removed
+            self.replaced[stage] += replaced
+
+    def add_imaging(self, hits, misses):
+        with self.lock:
+            self.imaging_hits += hits
+            self.imaging_misses += misses
+
+    def add_glyphs(self, rendered, compared):
+        with self.lock:
+            self.glyphs_rendered += rendered
+            self.glyphs_compared += compared
+
+    def as_dict(self):
+        with self.lock:
+            return {'texts': self.texts,
+                    'fast_path_hits': self.fast_path_hits,
+                    'time': dict(self.time),
+                    'removed': dict(self.removed),
+                    'replaced': dict(self.replaced),
+                    'imaging_hits': self.imaging_hits,
+                    'imaging_misses': self.imaging_misses,
+                    'glyphs_rendered': self.glyphs_rendered,
+                    'glyphs_compared': self.glyphs_compared}
+
+    def __repr__(self):
+        return "NormaliseStats(%r)" % self.as_dict()
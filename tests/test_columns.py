@@ -0,0 +1,57 @@
+"""
+Tests for columns.py, with an engine that doesn't need any fonts
+"""
+import os, sys
+import pytest
+
+pd = pytest.importorskip("pandas")
+pa = pytest.importorskip("pyarrow")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import columns
+
+class LowerEngine:
+
+    def __init__(self):
+        self.calls = []
+
+    def normalise_many(self, texts):
+        texts = list(texts)
+        self.calls.append(texts)
+        return [t.lower() for t in texts]
+
+def test_series_normalises_each_value_once():
+    engine = LowerEngine()
+    series = pd.Series(["A", "b", None, "A"], index=[3, 4, 5, 6], name="x")
+    result = columns.normalise_column(engine, series)
+    assert result.tolist()[:2] == ["a", "b"] and pd.isna(result[5]) and result[6] == "a"
+    assert result.index.tolist() == [3, 4, 5, 6] and result.name == "x"
+    assert engine.calls == [["A", "b"]]
+
+def test_category_series():
+    series = pd.Series(["Ünïcode", "ABC", None, "abc"], dtype="category")
+    result = columns.normalise_column(LowerEngine(), series)
+    assert isinstance(result.dtype, pd.CategoricalDtype)
+    assert result.tolist()[:2] == ["ünïcode", "abc"] and pd.isna(result[2]) and result[3] == "abc"
+    assert sorted(result.cat.categories) == ["abc", "ünïcode"]
+
+def test_empty_category_series():
+    series = pd.Series([None, None], dtype=pd.CategoricalDtype([]))
+    assert columns.normalise_column(LowerEngine(), series).isna().all()
+
+def test_arrow_arrays():
+    engine = LowerEngine()
+    assert columns.normalise_column(engine, pa.array(["A", None, "A"])).to_pylist() == ["a", None, "a"]
+    chunked = pa.chunked_array([["A", "B"], [None, "A"]], type=pa.large_string())
+    result = columns.normalise_column(engine, chunked)
+    assert result.type == pa.large_string() and result.to_pylist() == ["a", "b", None, "a"]
+
+def test_dictionary_arrays():
+    engine = LowerEngine()
+    array = pa.array(["A", "b", None, "A"]).dictionary_encode()
+    assert columns.normalise_column(engine, array).to_pylist() == ["a", "b", None, "a"]
+    chunked = pa.chunked_array([pa.array(["A", None]).dictionary_encode(), pa.array(["C", "A"]).dictionary_encode()])
+    result = columns.normalise_column(engine, chunked)
+    assert pa.types.is_dictionary(result.type) and result.to_pylist() == ["a", None, "c", "a"]
+    #the chunks share one dictionary, so it was only normalised once
+    assert len(engine.calls) == 2
@@ -0,0 +1,163 @@
+"""
+Tests using the bundled fonts, run with: python -m pytest tests
+They are skipped if PIL, numpy, fontTools or word2number aren't installed
+"""
+from concurrent.futures import ThreadPoolExecutor
+import contextlib, io, os, random, sys
+import pytest
+
+for module in ["PIL", "numpy", "fontTools", "word2number"]:
+    pytest.importorskip(module)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+import normalise_all
+
+#greek, cyrillic, enclosed alphanumerics and ascii
+MIXED_RANGES = [(0x391, 0x3C9), (0x410, 0x44F), (0x2460, 0x24FF), (0x61, 0x7A)]
+
+@pytest.fixture(scope="session")
+def cache_dir(tmp_path_factory):
+    return str(tmp_path_factory.mktemp("cache"))
+
+def make_normaliser(font_dir, **kwargs):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return normalise_all.Normalise(font_dir=os.path.join(ROOT, font_dir), **kwargs)
+
+def random_texts(seed, n, length=12, ranges=MIXED_RANGES):
+    rng = random.Random(seed)
+    return ["".join([" " if rng.random() < 0.15 else chr(rng.randint(*rng.choice(ranges))) for i in range(length)])
+            for j in range(n)]
+
+def test_normalise_many_matches_normalise(cache_dir):
+    texts = random_texts(0, 600)
+    batch = make_normaliser("all_fonts", cache_dir=cache_dir).normalise_many(texts)
+    single = make_normaliser("all_fonts", cache_dir=cache_dir)
+    assert batch == [single.normalise(t) for t in texts]
+
+def test_unstable_texts_match_fast_path(cache_dir):
+    n = make_normaliser("all_fonts", cache_dir=cache_dir)
+    for length in [6, 40]:
+        #short ascii texts are checked one at a time, longer ones with numpy
+        texts = random_texts(2, 300, length=length, ranges=[(0x20, 0x7E)]) + random_texts(3, 300) + ["", " ", "a\x00", "\x7f"]
+        assert n.unstable_texts(texts) == [not n.fast_path(t) for t in texts]
+
+def test_threads_match_normalise(cache_dir):
+    texts = random_texts(1, 600)
+    shared = make_normaliser("all_fonts", cache_dir=cache_dir)
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        threaded = list(executor.map(shared.normalise, texts))
+    single = make_normaliser("all_fonts", cache_dir=cache_dir)
+    assert threaded == [single.normalise(t) for t in texts]
+
+def test_pool_matches_normalise(cache_dir):
+    import parallel
+    texts = random_texts(4, 600)
+    with parallel.NormalisePool(make_normaliser("all_fonts", cache_dir=cache_dir), processes=3, chunk_size=50) as pool:
+        pooled = pool.normalise_many(texts)
+    single = make_normaliser("all_fonts", cache_dir=cache_dir)
+    assert pooled == [single.normalise(t) for t in texts]
+
+def test_cached_templates_are_shared(cache_dir):
+    import numpy as np
+    texts = random_texts(5, 20)
+    expected = make_normaliser("all_fonts", comparison="NRMSE").normalise_many(texts)
+    for i in range(2):
+        #the first one works the float arrays out and saves them, the second loads them
+        n = make_normaliser("all_fonts", cache_dir=cache_dir, comparison="NRMSE")
+        assert all([isinstance(p, np.memmap) for p in n.template_index.prepared])
+        assert n.normalise_many(texts) == expected
+
+def test_monospace_font_detected(cache_dir):
+    n = make_normaliser("monospace_fonts", cache_dir=cache_dir)
+    assert n.monospace_fonts == set(["NotoSansMono-Regular.ttf"])
+    #advances of 0 or a whole number of spaces, so no character was measured
+    assert set(n.font_points["NotoSansMono-Regular.ttf"].values()) <= set([40, 80, 120])
+    assert n.normalise("Hello  World") == "hello world"
+
+def test_lazy_fonts_share_face_and_profile_height(cache_dir):
+    n = make_normaliser("all_fonts", cache_dir=cache_dir, lazy_fonts=True)
+    n.normalise("ⓐ")
+    assert len(n.font_objects) != 0
+    #the thread that loaded a font draws with the same face
+    assert all([n.font_object(fn) is font_obj for fn, font_obj in n.font_objects.items()])
+    assert ":%s:" % n.height in n.db_profile
+
+def test_table_only_settings_must_match(cache_dir, tmp_path):
+    import static_table
+    n = make_normaliser("monospace_fonts", cache_dir=cache_dir)
+    path = str(tmp_path / "table.json")
+    with contextlib.redirect_stdout(io.StringIO()):
+        static_table.save_table(static_table.compile_table(n, processes=1), path)
+        table_only = normalise_all.Normalise(table_path=path)
+        assert table_only.normalise("Hello  World") == "hello world"
+        for kwargs in [{'comparison': 'SSIM'}, {'px_width': 30}, {'candidates': 8}]:
+            with pytest.raises(Exception, match="Table was compiled with"):
+                normalise_all.Normalise(table_path=path, **kwargs)
+
+def test_stream_jsonl_holds_only_lines_in_flight(cache_dir):
+    import normalise, parallel
+    read = [0]
+    def lines():
+        for i in range(5000):
+            read[0] += 1
+            #most lines don't have the field, or aren't JSON at all
+            yield '{"a": "Ⓗi %s"}' % i if i % 1000 == 0 else ('{"b": 1}' if i % 2 else "not json")
+    stats = {'bad_lines': 0}
+    with parallel.NormalisePool(make_normaliser("monospace_fonts", cache_dir=cache_dir), processes=2, chunk_size=16) as pool:
+        written = 0
+        for line in normalise.stream_jsonl(pool, lines(), ["a"], stats):
+            written += 1
+            #at most 2 chunks per worker in flight, plus the chunk being read
+            assert read[0] - written <= 5 * 16
+    assert written == 5000 and stats['bad_lines'] == 2495
+
+def test_imaging_hits_and_misses(cache_dir):
+    n = make_normaliser("all_fonts", cache_dir=cache_dir, instrument=True)
+    n.normalise("α β α")
+    n.normalise("α β γ")
+    n.normalise_many(["δ", "δα", "ε"])
+    stats = n.stats.as_dict()
+    #misses are learned once per batch (α β, γ, δ ε), hits once per text (α β, α)
+    assert (stats['imaging_misses'], stats['imaging_hits']) == (5, 3)
+    assert stats['glyphs_rendered'] == stats['glyphs_compared'] == 5
+
+def line_emoji(start, emoji_id, mid):
+    return chr(start) + chr(emoji_id) + mid + chr(0x10FFFF)
+
+def test_line_emojis(cache_dir):
+    n = make_normaliser("monospace_fonts", cache_dir=cache_dir)
+    #a number word is replaced by the number
+    assert n.normalise_LINE_emojis("a" + line_emoji(0x100801, 0x100101, "seven") + "b") == "a7b"
+    #sticker id ranges keep their text, and one id is always 13
+    assert n.normalise_LINE_emojis(line_emoji(0x100801, 0x100101, "smile")) == "smile"
+    assert n.normalise_LINE_emojis(line_emoji(0x102001, 0x100186, "hello")) == "hello"
+    assert n.normalise_LINE_emojis(line_emoji(0x102001, 1049036, "hello")) == "13"
+    #anything else is replaced, kept with remove=0, and always replaced with remove=2
+    other = line_emoji(0x100801, 0x100200, "ok")
+    assert n.normalise_LINE_emojis("a" + other + "b") == "a b"
+    assert n.normalise_LINE_emojis("a" + other + "b", remove=0) == "a" + other + "b"
+    assert n.normalise_LINE_emojis(line_emoji(0x100801, 0x100101, "seven"), replacement="_", remove=2) == "_"
+    #lone start and end characters, and a start that is never closed, are removed
+    assert n.normalise_LINE_emojis("a" + chr(0x100801)) == "a"
+    assert n.normalise_LINE_emojis(chr(0x10FFFF) + "b") == "b"
+    assert n.normalise_LINE_emojis(chr(0x100801) + chr(0x100101) + "seven") == "seven"
+    assert n.normalise("x" + line_emoji(0x100801, 0x100101, "seven") + "y") == "x7y"
+
+def test_db_persists_learned_chars(cache_dir, tmp_path):
+    import gc, weakref
+    db_path = str(tmp_path / "known.db")
+    n = make_normaliser("all_fonts", cache_dir=cache_dir, db_path=db_path)
+    expected = n.normalise("α β")
+    learned = dict([(o, n.known_normalisations.get(o, "")) for o in [ord("α"), ord("β")]])
+    n.close_db()
+    #close_db unregisters the exit flush, so nothing keeps the instance alive
+    ref = weakref.ref(n)
+    del n
+    gc.collect()
+    assert ref() is None
+    reloaded = make_normaliser("all_fonts", cache_dir=cache_dir, db_path=db_path, instrument=True)
+    assert dict([(o, reloaded.known_normalisations.get(o, "")) for o in learned]) == learned
+    assert reloaded.normalise("α β") == expected
+    assert reloaded.stats.as_dict()['imaging_misses'] == 0
+    reloaded.close_db()
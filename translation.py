@@ -0,0 +1,132 @@
+"""
+Lazily filled tables for str.translate, and sets of ords stored as intervals
+"""
+import bisect, collections, re
+
+#more distinct characters than this and a table starts again from its prefilled entries
+MAXSIZE = 1 << 16
+
+class TranslationTable(dict):
+    """
+    Maps ord -> replacement string, computed by char_func(char) the first time str.translate asks for it
+    [0] after the first lookup every character is a C-speed dict hit
+    [1] char_func must only depend on the character, never on its neighbours
+    [2] memory is bounded by maxsize entries, prefilled entries are kept when the table is reset
+    [3] self.dependents maps an ord to the keys whose replacement contains it (other than the key itself),
+        so without only has to look at the entries it drops
+    """
+
+    def __init__(self, char_func, maxsize=MAXSIZE):
+        dict.__init__(self)
+        self.char_func = char_func
+        self.maxsize = maxsize
+        self.prefilled = {}
+        self.dependents = {}
+
+    def __missing__(self, o):
+        if len(self) >= self.maxsize:
+            self.clear()
+            self.dependents = {}
+            self.update(self.prefilled)
+            for k, v in self.prefilled.items():
+                self.add_dependents(k, v)
+        value = self.char_func(chr(o))
+        #dependents first, so any entry another thread can see has its dependents recorded
+        self.add_dependents(o, value)
+        self[o] = value
+        return value
+
+    def add_dependents(self, o, value):
+        if value == chr(o):
+            return
+        for c in set(value):
+            if ord(c) != o:
+                #setdefault and append are both atomic, so threads filling the table at once don't lose any
+                self.dependents.setdefault(ord(c), []).append(o)
+
+    def prefill(self, ords):
+        """
+        Computes the entries for ords up front, eg for ranges that most text uses
+        """
+        entries = {o:self.char_func(chr(o)) for o in ords}
+        for o, value in entries.items():
+            self.add_dependents(o, value)
+        self.prefilled.update(entries)
+        self.update(self.prefilled)
+
+    def without(self, ords):
+        """
+        Returns a copy without the entries for ords and every entry whose replacement contains one of them
+        [0] the table itself isn't changed, so threads still translating with it aren't affected
+        [1] costs a copy of the table and a lookup per dropped entry, however many entries the table has
+        """
+        table = TranslationTable(self.char_func, self.maxsize)
+        #dict.copy is atomic, iterating over a table other threads are filling isn't
+        #the entries are copied before the dependents, so every copied entry's dependents get copied too
+        table.update(self.copy())
+        table.prefilled = self.prefilled.copy()
+        table.dependents = {k:list(v) for k,v in self.dependents.copy().items()}
+        dropped = set(ords)
+        for o in ords:
+            dropped.update(table.dependents.get(o, ()))
+        for o in dropped:
+            table.pop(o, None)
+            table.prefilled.pop(o, None)
+        return table
+
+class IntervalSet:
+    """
+    A set of ords stored as sorted, merged (start, end) intervals (end included)
+    [0] membership is a binary search, so it costs the same however many ords the intervals cover
+    [1] regex() matches any one of the ords, for running over whole texts
+    """
+
+    def __init__(self, ranges=(), ords=()):
+        intervals = sorted(list(ranges) + [(o, o) for o in ords])
+        merged = []
+        for start, end in intervals:
+            if merged and start <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        self.starts = [start for start, end in merged]
+        self.ends = [end for start, end in merged]
+
+    def __contains__(self, o):
+        i = bisect.bisect_right(self.starts, o) - 1
+        return i >= 0 and o <= self.ends[i]
+
+    def __len__(self):
+        return sum([end - start + 1 for start, end in zip(self.starts, self.ends)])
+
+    def __iter__(self):
+        for start, end in zip(self.starts, self.ends):
+            for o in range(start, end+1):
+                yield o
+
+    def regex(self):
+        parts = [re.escape(chr(start)) if start == end else "%s-%s" % (re.escape(chr(start)), re.escape(chr(end)))
+                 for start, end in zip(self.starts, self.ends)]
+        return re.compile("[%s]" % "".join(parts))
+
+def chain_chars(char, char_funcs):
+    """
+    Runs char through each per-character function in turn
+    """
+    text = char
+    for char_func in char_funcs:
+        text = "".join([char_func(c) for c in text])
+    return text
+
+def count_changes(text, table):
+    """
+    Returns how many characters of text the table removes and how many it replaces
+    """
+    removed = replaced = 0
+    for c, n in collections.Counter(text).items():
+        value = table[ord(c)]
+        if value == "":
+            removed += n
+        elif value != c:
+            replaced += n
+    return removed, replaced